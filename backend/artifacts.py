@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from engine import FactorModel
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+ARRAY_FILES = {
+    'item_factors': 'item_factors.npy',
+    'item_biases': 'item_biases.npy',
+    'items': 'items.npy',
+    'users': 'users.npy',
+}
+
+
+def vocabulary_version(item_ids):
+    """Fingerprint of the item vocabulary, so clients holding item indices can tell when it changes."""
+    return hashlib.sha1('\n'.join(str(item) for item in item_ids).encode()).hexdigest()[:16]
+
+
+def save_array(path, array):
+    """np.save through a temporary file, so workers that have the old file memory-mapped keep reading it whole."""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', suffix='.npy', delete=False) as f:
+        np.save(f, array)
+    os.replace(f.name, path)
+
+
+def write_json(path, contents):
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path) or '.', suffix='.json', delete=False) as f:
+        json.dump(contents, f, indent=2)
+    os.replace(f.name, path)
+
+
+def has_artifacts(model_dir):
+    return os.path.exists(os.path.join(model_dir, MANIFEST_NAME))
+
+
+def export_artifacts(model, model_dir, dtype=np.float32):
+    """Write the frozen parts of a KernelMF model as .npy arrays plus a JSON manifest."""
+    users = sorted(model.user_id_map, key=model.user_id_map.get)
+    return export_factor_model(FactorModel.from_kernel_mf(model), users, model_dir, dtype)
+
+
+def export_factor_model(factor_model, users, model_dir, dtype=np.float32):
+    arrays = {
+        'item_factors': factor_model.item_factors.astype(dtype),
+        'item_biases': factor_model.item_biases.astype(dtype),
+        'items': np.array(factor_model.item_ids, dtype=str),
+        'users': np.array([str(user) for user in users], dtype=str),
+    }
+    for name, array in arrays.items():
+        save_array(os.path.join(model_dir, ARRAY_FILES[name]), np.ascontiguousarray(array))
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_name': os.path.basename(os.path.normpath(model_dir)),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'kernel': factor_model.kernel,
+        'n_items': factor_model.n_items,
+        'vocabulary_version': vocabulary_version(factor_model.item_ids),
+        'n_users': len(users),
+        'n_factors': factor_model.n_factors,
+        'global_mean': factor_model.global_mean,
+        'min_rating': factor_model.min_rating,
+        'max_rating': factor_model.max_rating,
+        'reg': factor_model.reg,
+        'dtype': np.dtype(dtype).name,
+        'files': ARRAY_FILES,
+    }
+    # Write the manifest last so a half-written export is never picked up
+    write_json(os.path.join(model_dir, MANIFEST_NAME), manifest)
+
+    return manifest
+
+
+def load_manifest(model_dir):
+    with open(os.path.join(model_dir, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f'Unsupported artifact format {manifest.get("format_version")} in {model_dir}.')
+    return manifest
+
+
+def load_artifacts(model_dir, mmap=True):
+    """Load a FactorModel whose arrays are memory-mapped, so workers share them through the page cache."""
+    manifest = load_manifest(model_dir)
+    mmap_mode = 'r' if mmap else None
+
+    def array(name):
+        return np.load(os.path.join(model_dir, manifest['files'][name]), mmap_mode=mmap_mode)
+
+    factor_model = FactorModel(array('items').tolist(), array('item_factors'), array('item_biases'),
+                               manifest['global_mean'], min_rating=manifest['min_rating'],
+                               max_rating=manifest['max_rating'], reg=manifest['reg'],
+                               kernel=manifest['kernel'])
+    return factor_model, manifest
+
+
+def load_users(model_dir):
+    manifest = load_manifest(model_dir)
+    return np.load(os.path.join(model_dir, manifest['files']['users']), mmap_mode='r')
+
+
+if __name__ == '__main__':
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else 'models/gridsearch/KernelMF_n5000_k50_l20.005_lr0.01'
+    with open(os.path.join(model_dir, 'model.p'), 'rb') as f:
+        model = pickle.load(f)
+    manifest = export_artifacts(model, model_dir)
+    print(f'Exported {manifest["n_items"]} items x {manifest["n_factors"]} factors to {model_dir}.')
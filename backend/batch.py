@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import save_array, write_json
+from engine import top_k_rows
+
+MEMORY_BUDGET = int(os.environ.get('BATCH_MEMORY_BUDGET', 256 * 1024 ** 2))
+# Precomputed results live inside the model directory, so they're versioned with the model
+PRECOMPUTED_DIR = 'precomputed'
+
+
+def ratings_to_csr(factor_model, members, films, ratings, users=None):
+    """Group long-format ratings by member into CSR arrays of model indices, dropping unknown films.
+
+    Rows follow users when given, otherwise members in order of first appearance.
+    """
+    indices = pd.Index(factor_model.item_ids).get_indexer(pd.Index(films))
+    ratings = np.asarray(ratings, dtype=np.float64)
+    keep = (indices >= 0) & ~np.isnan(ratings)
+
+    if users is None:
+        codes, users = pd.factorize(pd.Series(members))
+    else:
+        codes = pd.Index(users).get_indexer(pd.Index(members))
+    order = np.argsort(codes[keep], kind='stable')
+    offsets = np.zeros(len(users) + 1, dtype=np.intp)
+    np.cumsum(np.bincount(codes[keep], minlength=len(users)), out=offsets[1:])
+
+    return list(users), offsets, indices[keep][order].astype(np.intp), ratings[keep][order]
+
+
+def recommend_batch(factor_model, offsets, indices, ratings, k, exclude_offsets=None, exclude_indices=None,
+                    film_ratings=None, allowed=None, memory_budget=MEMORY_BUDGET):
+    """Top-k items for every user in CSR form, as (items, scores, predictions) arrays of shape (n_users, k).
+
+    Rated items and any extra exclusions are never recommended. With film_ratings, items are
+    ranked by how far the prediction beats the film's average like relative=True online.
+    Slots left over when fewer than k items are allowed hold -1.
+    """
+    offsets, indices = np.asarray(offsets, dtype=np.intp), np.asarray(indices, dtype=np.intp)
+    n_users, n_items = len(offsets) - 1, factor_model.n_items
+    k = min(k, n_items)
+    user_biases, user_vectors = factor_model.fold_in_batch(offsets, indices, ratings, memory_budget)
+
+    items = np.empty((n_users, k), dtype=np.int32)
+    scores = np.empty((n_users, k), dtype=np.float32)
+    predictions = np.empty((n_users, k), dtype=np.float32)
+    # Prediction and score blocks of n_items doubles each per user
+    block_users = max(1, memory_budget // (16 * n_items))
+
+    for start in range(0, n_users, block_users):
+        stop = min(start + block_users, n_users)
+        block_predictions = factor_model.predict_batch(user_biases[start:stop], user_vectors[start:stop])
+        block_scores = block_predictions.copy() if film_ratings is None else 2 * block_predictions - film_ratings
+        block_scores[np.isnan(block_scores)] = -np.inf
+        if allowed is not None:
+            block_scores[:, ~allowed] = -np.inf
+
+        for block_offsets, block_indices in ((offsets, indices), (exclude_offsets, exclude_indices)):
+            if block_offsets is None:
+                continue
+            lo, hi = block_offsets[start], block_offsets[stop]
+            rows = np.repeat(np.arange(stop - start), np.diff(block_offsets[start:stop + 1]))
+            block_scores[rows, block_indices[lo:hi]] = -np.inf
+
+        top = top_k_rows(block_scores, k)
+        found = np.maximum(top, 0)
+        items[start:stop] = top
+        scores[start:stop] = np.where(top >= 0, np.take_along_axis(block_scores, found, axis=1), np.nan)
+        predictions[start:stop] = np.where(top >= 0, np.take_along_axis(block_predictions, found, axis=1), np.nan)
+
+    return items, scores, predictions
+
+
+def save_precomputed(model_dir, users, items, scores, predictions, vocabulary, relative=False):
+    out_dir = os.path.join(model_dir, PRECOMPUTED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    save_array(os.path.join(out_dir, 'users.npy'), np.array([str(user) for user in users], dtype=str))
+    save_array(os.path.join(out_dir, 'items.npy'), np.ascontiguousarray(items, dtype=np.int32))
+    save_array(os.path.join(out_dir, 'scores.npy'), np.ascontiguousarray(scores, dtype=np.float32))
+    save_array(os.path.join(out_dir, 'predictions.npy'), np.ascontiguousarray(predictions, dtype=np.float32))
+
+    manifest = {'vocabulary_version': vocabulary, 'n_users': len(users), 'k': int(items.shape[1]), 'relative': relative,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+    # Like the model artifacts, the manifest goes last so a half-written table is never loaded
+    write_json(os.path.join(out_dir, 'manifest.json'), manifest)
+    return manifest
+
+
+class PrecomputedRecommendations:
+    """Memory-mapped top-k table from the batch job, looked up by member."""
+
+    def __init__(self, users, items, scores, predictions, manifest):
+        self.row = {user: i for i, user in enumerate(users.tolist())}
+        self.items = items
+        self.scores = scores
+        self.predictions = predictions
+        self.manifest = manifest
+
+    def __len__(self):
+        return len(self.row)
+
+    @classmethod
+    def load(cls, model_dir, vocabulary=None):
+        """The table for model_dir, or None if there isn't one built against this vocabulary."""
+        out_dir = os.path.join(model_dir, PRECOMPUTED_DIR)
+        try:
+            with open(os.path.join(out_dir, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if vocabulary is not None and manifest.get('vocabulary_version') != vocabulary:
+            print(f'Ignoring precomputed recommendations in {out_dir}, they were built for another vocabulary.')
+            return None
+
+        def array(name):
+            return np.load(os.path.join(out_dir, f'{name}.npy'), mmap_mode='r')
+
+        return cls(array('users'), array('items'), array('scores'), array('predictions'), manifest)
+
+    def get(self, user, k=None):
+        """(items, scores, predictions) for user, best first, or None if the user wasn't precomputed."""
+        row = self.row.get(user)
+        if row is None:
+            return None
+        items = self.items[row, :k]
+        found = items >= 0
+        return items[found], self.scores[row, :k][found], self.predictions[row, :k][found]
+
+
+def main():
+    from film_index import FILM_INDEX_PATH, FilmIndex
+    from registry import MODELS_ROOT, LoadedModel
+
+    parser = argparse.ArgumentParser(description='Precompute top-k recommendations for many members at once.')
+    parser.add_argument('ratings', help='CSV or Parquet file with member, film and rating columns.')
+    parser.add_argument('--model', default=os.environ.get('MODEL_NAME', 'KernelMF_n5000_k50_l20.005_lr0.01'))
+    parser.add_argument('--k', type=int, default=100)
+    parser.add_argument('--relative', action='store_true', help='Rank like relative=True, needs the film index.')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET // 1024 ** 2, help='In megabytes.')
+    args = parser.parse_args()
+
+    model_dir = os.path.join(MODELS_ROOT, args.model)
+    film_index = FilmIndex.load(FILM_INDEX_PATH) if args.relative else None
+    loaded = LoadedModel.load(model_dir, film_index)
+    if args.ratings.endswith('.parquet'):
+        frame = pd.read_parquet(args.ratings, columns=['member', 'film', 'rating'])
+    else:
+        frame = pd.read_csv(args.ratings, usecols=['member', 'film', 'rating'])
+
+    start = time.perf_counter()
+    users, offsets, indices, ratings = ratings_to_csr(loaded.factor_model, frame['member'], frame['film'],
+                                                      frame['rating'])
+    film_ratings = None
+    if film_index is not None:
+        film_ratings = np.where(loaded.film_rows >= 0, film_index.rating[loaded.film_rows], np.nan)
+    items, scores, predictions = recommend_batch(loaded.factor_model, offsets, indices, ratings, args.k,
+                                                 film_ratings=film_ratings,
+                                                 memory_budget=args.memory_budget * 1024 ** 2)
+    manifest = save_precomputed(model_dir, users, items, scores, predictions, loaded.vocabulary, args.relative)
+    print(f'Precomputed top {manifest["k"]} for {len(users)} members in {time.perf_counter() - start:.1f}s.')
+
+
+if __name__ == '__main__':
+    main()
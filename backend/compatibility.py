@@ -0,0 +1,65 @@
+import numpy as np
+
+# Pairs sharing fewer rated films than this get no correlation, it's mostly noise below that
+MIN_OVERLAP = 5
+
+
+def rating_matrix(offsets, indices, ratings):
+    """Dense (users, films) ratings over only the films someone in the group rated, plus which are rated."""
+    offsets = np.asarray(offsets, dtype=np.intp)
+    films, columns = np.unique(indices, return_inverse=True)
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    values = np.zeros((len(offsets) - 1, len(films)))
+    rated = np.zeros(values.shape, dtype=bool)
+    values[rows, columns] = ratings
+    rated[rows, columns] = True
+    return films, values, rated
+
+
+def co_rated_statistics(values, rated, min_overlap=MIN_OVERLAP):
+    """Pairwise overlap and agreement on co-rated films, every pair at once.
+
+    Each sum over the films both u and v rated is a matrix product against the rated mask,
+    e.g. sums[u, v] is u's total over films v also rated, so Pearson's r needs no pair loop.
+    """
+    mask = rated.astype(np.float64)
+    overlap = mask @ mask.T
+    sums = values @ mask.T
+    squares = np.square(values) @ mask.T
+    products = values @ values.T
+    counts = np.diag(overlap)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = overlap * products - sums * sums.T
+        variance = overlap * squares - np.square(sums)
+        correlation = covariance / np.sqrt(variance * variance.T)
+        rms_difference = np.sqrt(np.maximum(squares + squares.T - 2 * products, 0) / overlap)
+        jaccard = overlap / (counts[:, None] + counts[None, :] - overlap)
+    correlation[(overlap < max(min_overlap, 2)) | ~np.isfinite(correlation)] = np.nan
+    rms_difference[overlap == 0] = np.nan
+    jaccard[np.isnan(jaccard)] = 0.0
+
+    return {'overlap': overlap.astype(np.int64), 'jaccard': jaccard, 'correlation': np.clip(correlation, -1, 1),
+            'rms_difference': rms_difference}
+
+
+def latent_cosine(user_vectors):
+    norms = np.linalg.norm(user_vectors, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unit = user_vectors / norms[:, None]
+    return np.clip(unit @ unit.T, -1, 1)
+
+
+def compatibility(factor_model, offsets, indices, ratings, min_overlap=MIN_OVERLAP):
+    """Every pairwise compatibility measure for a group of users in CSR form, as (users, users) arrays.
+
+    The latent cosine compares the users' folded-in factor vectors, so it says something even
+    for pairs with few or no films in common.
+    """
+    _, values, rated = rating_matrix(offsets, indices, ratings)
+    results = co_rated_statistics(values, rated, min_overlap)
+    _, user_vectors = factor_model.fold_in_batch(offsets, indices, ratings)
+    results['latent_cosine'] = latent_cosine(user_vectors)
+    results['rated'] = np.diff(offsets)
+    return results
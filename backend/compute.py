@@ -0,0 +1,50 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge
+
+from instrumentation import profiled
+
+# Worker processes uvicorn starts, each with its own compute pool over the same memory-mapped model
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+COMPUTE_THREADS = int(os.environ.get('COMPUTE_THREADS', max(1, (os.cpu_count() or 1) // WORKERS)))
+# Requests allowed to wait for a thread on top of the ones running, the rest get a 503
+COMPUTE_QUEUE = int(os.environ.get('COMPUTE_QUEUE', 16 * COMPUTE_THREADS))
+
+IN_FLIGHT = Gauge('backend_compute_in_flight', 'Requests running or waiting in the compute pool.',
+                  multiprocess_mode='livesum')
+REJECTED = Counter('backend_compute_rejected', 'Requests turned away because the compute queue was full.')
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ComputePool:
+    """Runs CPU-bound request work off the event loop, refusing work past a fixed queue depth.
+
+    numpy releases the GIL in BLAS and LAPACK calls, so the threads overlap on fold-in and scoring.
+    """
+
+    def __init__(self, threads=COMPUTE_THREADS, queue=COMPUTE_QUEUE):
+        self.threads = threads
+        self.limit = threads + queue
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='compute')
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                REJECTED.inc()
+                raise Overloaded(f'{self.in_flight} requests already queued for {self.threads} compute threads.')
+            self.in_flight += 1
+        IN_FLIGHT.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, profiled(fn), *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            IN_FLIGHT.dec()
@@ -0,0 +1,177 @@
+import numpy as np
+
+
+class FactorModel:
+    """Frozen item side of a KernelMF model, used to fold users in without mutating it."""
+
+    def __init__(self, item_ids, item_factors, item_biases, global_mean,
+                 min_rating=0.0, max_rating=5.0, reg=0.01, kernel='linear'):
+        if kernel not in ('linear', 'sigmoid'):
+            raise ValueError(f'Fold-in is not supported for the {kernel} kernel.')
+
+        self.item_ids = list(item_ids)
+        self.item_index = {item: i for i, item in enumerate(self.item_ids)}
+        self.item_factors = np.ascontiguousarray(item_factors)
+        self.item_biases = np.ascontiguousarray(item_biases)
+        self.global_mean = float(global_mean)
+        self.min_rating = float(min_rating)
+        self.max_rating = float(max_rating)
+        self.reg = float(reg)
+        self.kernel = kernel
+
+    def __repr__(self):
+        return f'FactorModel(kernel={self.kernel}, n_items={self.n_items}, n_factors={self.n_factors})'
+
+    @classmethod
+    def from_kernel_mf(cls, model):
+        item_ids = sorted(model.item_id_map, key=model.item_id_map.get)
+        return cls(item_ids, model.item_features, model.item_biases, model.global_mean,
+                   min_rating=model.min_rating, max_rating=model.max_rating,
+                   reg=model.reg, kernel=model.kernel)
+
+    @property
+    def n_items(self):
+        return len(self.item_ids)
+
+    @property
+    def n_factors(self):
+        return self.item_factors.shape[1]
+
+    def lookup(self, items):
+        """Map item IDs to model indices, dropping the ones the model doesn't know."""
+        positions, indices = [], []
+        for position, item in enumerate(items):
+            index = self.item_index.get(item)
+            if index is not None:
+                positions.append(position)
+                indices.append(index)
+        return np.array(positions, dtype=np.intp), np.array(indices, dtype=np.intp)
+
+    def fold_in(self, indices, ratings):
+        """Closed-form ridge solve for a user's bias and latent vector against the frozen item factors.
+
+        For the linear kernel this is the fixed point that KernelMF.update_users converges to: its
+        SGD applies `reg` once per rating, so the penalty scales with the number of ratings. The
+        sigmoid kernel is solved on logit-transformed ratings instead, which only approximates
+        the point its SGD reaches on the squared error after the sigmoid.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(indices) == 0:
+            return 0.0, np.zeros(self.n_factors)
+
+        design, target = self.design(indices, ratings)
+        gram = design.T @ design
+        gram[np.diag_indices_from(gram)] += self.reg * len(indices)
+        solution = np.linalg.solve(gram, design.T @ target)
+
+        return float(solution[0]), solution[1:]
+
+    def design(self, indices, ratings):
+        """Least-squares design matrix (a bias column plus item factors) and targets for a set of ratings."""
+        ratings = np.asarray(ratings, dtype=np.float64)
+        if self.kernel == 'sigmoid':
+            scale = self.max_rating - self.min_rating
+            ratings = np.clip((ratings - self.min_rating) / scale, 1e-3, 1 - 1e-3)
+            ratings = np.log(ratings / (1 - ratings))
+
+        design = np.empty((len(indices), self.n_factors + 1))
+        design[:, 0] = 1.0
+        design[:, 1:] = self.item_factors[indices]
+        target = ratings - self.global_mean - self.item_biases[indices]
+        return design, target
+
+    def fold_in_batch(self, offsets, indices, ratings, memory_budget=256 * 1024 ** 2):
+        """fold_in for many users at once, with user u's ratings at indices/ratings[offsets[u]:offsets[u + 1]].
+
+        Users are sorted by rating count and solved in blocks, each a zero-padded stack of design
+        matrices no bigger than memory_budget bytes, so the Gram matrices come from batched matmuls.
+        """
+        offsets = np.asarray(offsets, dtype=np.intp)
+        indices = np.asarray(indices, dtype=np.intp)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        n_users, width = len(offsets) - 1, self.n_factors + 1
+        counts = np.diff(offsets)
+        biases, vectors = np.zeros(n_users), np.zeros((n_users, self.n_factors))
+
+        by_count = np.argsort(counts, kind='stable')
+        by_count = by_count[counts[by_count] > 0]
+        start = 0
+        while start < len(by_count):
+            # The block is padded to its largest user, which is the last one since they're sorted
+            stop = start + 1
+            while stop < len(by_count) and (stop + 1 - start) * counts[by_count[stop]] * width * 8 <= memory_budget:
+                stop += 1
+            users = by_count[start:stop]
+            block_counts = counts[users]
+
+            rows = np.repeat(np.arange(len(users)), block_counts)
+            ranks = np.arange(block_counts.sum()) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+            spans = np.concatenate([np.arange(offsets[u], offsets[u + 1]) for u in users])
+            flat_design, flat_target = self.design(indices[spans], ratings[spans])
+
+            design = np.zeros((len(users), block_counts[-1], width))
+            target = np.zeros((len(users), block_counts[-1], 1))
+            design[rows, ranks] = flat_design
+            target[rows, ranks, 0] = flat_target
+
+            transposed = design.transpose(0, 2, 1)
+            grams = transposed @ design
+            grams[:, np.arange(width), np.arange(width)] += self.reg * block_counts[:, None]
+            solution = np.linalg.solve(grams, transposed @ target)[..., 0]
+            biases[users], vectors[users] = solution[:, 0], solution[:, 1:]
+            start = stop
+
+        return biases, vectors
+
+    def predict(self, user_bias, user_vector, indices=None, bound_ratings=True):
+        factors = self.item_factors if indices is None else self.item_factors[indices]
+        biases = self.item_biases if indices is None else self.item_biases[indices]
+
+        scores = factors @ user_vector
+        scores += biases + (self.global_mean + user_bias)
+        if self.kernel == 'sigmoid':
+            scores = self.min_rating + (self.max_rating - self.min_rating) / (1 + np.exp(-scores))
+        if bound_ratings:
+            np.clip(scores, self.min_rating, self.max_rating, out=scores)
+
+        return scores
+
+
+    def predict_batch(self, user_biases, user_vectors, bound_ratings=True):
+        """predict for a block of users, one row of scores per user."""
+        scores = user_vectors @ self.item_factors.T
+        scores += self.item_biases
+        scores += (self.global_mean + np.asarray(user_biases))[:, None]
+        if self.kernel == 'sigmoid':
+            scores = self.min_rating + (self.max_rating - self.min_rating) / (1 + np.exp(-scores))
+        if bound_ratings:
+            np.clip(scores, self.min_rating, self.max_rating, out=scores)
+
+        return scores
+
+
+def allowed_mask(n_items, exclude=()):
+    mask = np.ones(n_items, dtype=bool)
+    mask[np.asarray(exclude, dtype=np.intp)] = False
+    return mask
+
+
+def top_k(scores, k, allowed=None):
+    """Indices of the k highest scores, best first, restricted to the allowed mask."""
+    candidates = np.arange(len(scores)) if allowed is None else np.flatnonzero(allowed)
+
+    k = len(candidates) if k < 0 else min(k, len(candidates))
+    if k < len(candidates):
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def top_k_rows(scores, k):
+    """Column indices of the k highest scores in each row, best first. -inf scores come back as -1."""
+    k = min(k, scores.shape[1])
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidates[np.isneginf(np.take_along_axis(scores, candidates, axis=1))] = -1
+    return candidates
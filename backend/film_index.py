@@ -0,0 +1,112 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+FILM_INDEX_PATH = 'data/film_index.npz'
+
+
+def _names(entries, key):
+    if not isinstance(entries, list):
+        return []
+    return [entry.get(key) for entry in entries if entry.get(key)]
+
+
+def _bitmasks(rows, vocabulary):
+    position = {name: i for i, name in enumerate(vocabulary)}
+    n_words = max(1, (len(vocabulary) + 63) // 64)
+    bits = np.zeros((len(rows), n_words), dtype=np.uint64)
+    for row, names in enumerate(rows):
+        for name in names:
+            word, bit = divmod(position[name], 64)
+            bits[row, word] |= np.uint64(1) << np.uint64(bit)
+    return bits
+
+
+class FilmIndex:
+    """Columnar view of the film catalogue that turns the advanced filters into boolean masks."""
+
+    def __init__(self, ids, release_year, run_time, popularity, rating,
+                 genre_names, genre_bits, country_codes, country_bits):
+        self.ids = np.asarray(ids)
+        self.row = {film: i for i, film in enumerate(self.ids.tolist())}
+        self.release_year = release_year
+        self.run_time = run_time
+        self.popularity = popularity
+        self.rating = rating
+        self.genre_names = list(genre_names)
+        self.genre_bits = genre_bits
+        self.country_codes = list(country_codes)
+        self.country_bits = country_bits
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_film_data(cls, film_data):
+        genres = [_names(x, 'name') for x in film_data['genres']]
+        countries = [_names(x, 'code') for x in film_data['countries']]
+        genre_names = sorted({name for names in genres for name in names})
+        country_codes = sorted({code for codes in countries for code in codes})
+
+        def numeric(column):
+            return pd.to_numeric(film_data[column], errors='coerce').to_numpy(dtype=np.float32)
+
+        return cls(ids=film_data['id'].astype(str).to_numpy(),
+                   release_year=numeric('releaseYear'),
+                   run_time=numeric('runTime'),
+                   popularity=numeric('popularity'),
+                   rating=numeric('rating'),
+                   genre_names=genre_names,
+                   genre_bits=_bitmasks(genres, genre_names),
+                   country_codes=country_codes,
+                   country_bits=_bitmasks(countries, country_codes))
+
+    @classmethod
+    def load(cls, path=FILM_INDEX_PATH):
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def save(self, path=FILM_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, ids=self.ids.astype(str), release_year=self.release_year, run_time=self.run_time,
+                 popularity=self.popularity, rating=self.rating,
+                 genre_names=np.array(self.genre_names, dtype=str), genre_bits=self.genre_bits,
+                 country_codes=np.array(self.country_codes, dtype=str), country_bits=self.country_bits)
+
+    def locate(self, films):
+        """Catalogue row for each film ID, -1 where the film isn't in the catalogue."""
+        return np.array([self.row.get(film, -1) for film in films], dtype=np.intp)
+
+    def _has_any(self, bits, vocabulary, names):
+        position = {name: i for i, name in enumerate(vocabulary)}
+        wanted = np.zeros(bits.shape[1], dtype=np.uint64)
+        for name in names:
+            if name in position:
+                word, bit = divmod(position[name], 64)
+                wanted[word] |= np.uint64(1) << np.uint64(bit)
+        return (bits & wanted).any(axis=1)
+
+    def mask(self, year_range=None, runtime_range=None, popularity_range=None, rating_range=None,
+             country_specification=None, include_genres=None):
+        # Same semantics as the old utils.filter_movie_list: bounds are inclusive and
+        # films with missing metadata never pass a range filter.
+        mask = np.ones(len(self), dtype=bool)
+        for column, bounds in ((self.release_year, year_range), (self.run_time, runtime_range),
+                               (self.popularity, popularity_range), (self.rating, rating_range)):
+            if bounds:
+                mask &= (column >= bounds[0]) & (column <= bounds[1])
+        if country_specification:
+            mask &= self._has_any(self.country_bits, self.country_codes, [country_specification])
+        if include_genres:
+            mask &= self._has_any(self.genre_bits, self.genre_names, include_genres)
+        return mask
+
+
+if __name__ == '__main__':
+    film_data_path = sys.argv[1] if len(sys.argv) > 1 else '../frontend/data/film_data.p'
+    index_path = sys.argv[2] if len(sys.argv) > 2 else FILM_INDEX_PATH
+    film_index = FilmIndex.from_film_data(pd.read_pickle(film_data_path))
+    film_index.save(index_path)
+    print(f'Wrote {len(film_index)} films to {index_path}.')
@@ -0,0 +1,137 @@
+import contextvars
+import cProfile
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Requests sent with an X-Profile header are run under cProfile and dumped here. Unset turns profiling off.
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_SECONDS = Histogram('backend_request_seconds', 'Time spent handling each HTTP request.',
+                            ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram('backend_stage_seconds', 'Time spent in each stage of serving a request.',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+PROFILED_REQUESTS = Counter('backend_profiled_requests', 'Requests run under cProfile.', ['route'])
+
+# Only one profiler can be enabled at a time, so overlapping X-Profile requests run unprofiled
+_profiling = threading.Lock()
+# Profiles of the compute jobs the current request ran, None when it isn't profiled
+_job_profiles = contextvars.ContextVar('job_profiles', default=None)
+
+
+@contextmanager
+def timed(stage):
+    """Record how long the block takes under stage in backend_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def profiled(fn):
+    """Wrap a job for another thread so it's profiled there when the current request is.
+
+    cProfile only sees the thread that enabled it, so instrument_request merges the job's profile in.
+    """
+    profiles = _job_profiles.get()
+    if profiles is None:
+        return fn
+
+    def run(*args):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 only one profiler can be active per process
+            return fn(*args)
+        try:
+            return fn(*args)
+        finally:
+            profiler.disable()
+            profiles.append(profiler)
+
+    return run
+
+
+def route_of(request):
+    # The route template rather than the raw path, so every user doesn't become a new label
+    route = request.scope.get('route')
+    return getattr(route, 'path', 'unmatched')
+
+
+async def instrument_request(request, call_next):
+    """FastAPI HTTP middleware timing every request, and profiling it when asked to.
+
+    The request's own profiler covers the event loop thread, so a profile taken under load
+    includes slices of whatever other requests ran while this one awaited. Work the request
+    hands to ComputePool is profiled on the compute thread and merged in.
+    """
+    profile = PROFILE_DIR is not None and 'x-profile' in request.headers and _profiling.acquire(blocking=False)
+    profiler = cProfile.Profile() if profile else None
+    job_profiles = [] if profile else None
+    token = _job_profiles.set(job_profiles)
+    start = time.perf_counter()
+    status = 500
+    try:
+        if profiler is not None:
+            profiler.enable()
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiling.release()
+        _job_profiles.reset(token)
+        route = route_of(request)
+        REQUEST_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - start)
+
+    if profiler is not None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = route.strip('/').replace('/', '_').replace('{', '').replace('}', '') or 'root'
+        path = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%dT%H%M%S")}.{time.time_ns() // 1000 % 1000000:06d}'
+                                         f'-{os.getpid()}-{name}.prof')
+        stats = pstats.Stats(profiler)
+        for job_profiler in job_profiles:
+            stats.add(job_profiler)
+        stats.dump_stats(path)
+        PROFILED_REQUESTS.labels(route).inc()
+        response.headers['X-Profile-Path'] = path
+    return response
+
+
+class ServingCollector:
+    """Exposes the registry's per-model latency counters and the result cache stats at scrape time."""
+
+    def __init__(self, registry, result_cache=None):
+        self.registry = registry
+        self.result_cache = result_cache
+
+    def collect(self):
+        requests = CounterMetricFamily('backend_model_requests', 'Recommendations served per model.',
+                                       labels=['model', 'role'])
+        seconds = CounterMetricFamily('backend_model_seconds', 'Time spent recommending per model.',
+                                      labels=['model', 'role'])
+        for role, loaded in (('active', self.registry.active), ('candidate', self.registry.candidate)):
+            if loaded is not None:
+                latency = loaded.latency()
+                requests.add_metric([loaded.name, role], latency['requests'])
+                seconds.add_metric([loaded.name, role], latency['mean_seconds'] * latency['requests'])
+        yield requests
+        yield seconds
+
+        if self.result_cache is not None:
+            stats = self.result_cache.metrics()
+            for stat in ('hits', 'misses', 'evictions'):
+                yield CounterMetricFamily(f'backend_result_cache_{stat}', f'Result cache {stat}.', value=stats[stat])
+            yield GaugeMetricFamily('backend_result_cache_entries', 'Rating sets in the result cache.',
+                                    value=stats['entries'])
+            yield GaugeMetricFamily('backend_result_cache_bytes', 'Bytes held by the result cache.',
+                                    value=stats['bytes'])
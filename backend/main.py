@@ -1,44 +1,383 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
 
-import pickle
+import hmac
+import os
+import time
+from typing import Literal, Optional
 
 import uvicorn
-import pandas as pd
+import numpy as np
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from pydantic import ValidationError
 
-MODEL_NAME = 'KernelMF_n5000_k50_l20.005_lr0.01'
+from batch import ratings_to_csr, recommend_batch
+from compatibility import compatibility
+from compute import ComputePool, Overloaded
+from engine import allowed_mask, top_k
+from film_index import FILM_INDEX_PATH, FilmIndex
+from instrumentation import ServingCollector, instrument_request, timed
+from registry import MODELS_ROOT, ModelRegistry
+from result_cache import RESULT_CACHE_BYTES, ResultCache, fingerprint
+from schemas import (MAX_K, BatchRecommendationRequest, CompatibilityRequest, FilmFilters, FilterRequest,
+                     RecommendationRequest, unpack_ratings)
+
+MODEL_NAME = os.environ.get('MODEL_NAME', 'KernelMF_n5000_k50_l20.005_lr0.01')
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 5))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Seconds a client turned away by a full compute queue is told to wait
+RETRY_AFTER = os.environ.get('RETRY_AFTER', '1')
+
+if os.path.exists(FILM_INDEX_PATH):
+    film_index = FilmIndex.load(FILM_INDEX_PATH)
+    print('Film index loaded successfully.')
+else:
+    film_index = None
+    print(f'No film index at {FILM_INDEX_PATH}, filtered recommendations are disabled.')
+
+registry = ModelRegistry(MODELS_ROOT, film_index=film_index)
+registry.activate(MODEL_NAME)
+print('Model loaded successfully.')
+if MODEL_WATCH_INTERVAL > 0:
+    registry.watch(MODEL_WATCH_INTERVAL)
+
+# Predictions per model and rating set, so re-clicks and filter changes skip the fold-in
+result_cache = ResultCache(RESULT_CACHE_BYTES) if RESULT_CACHE_BYTES > 0 else None
+
+# Fold-ins, scoring and filtering run here, so the event loop keeps accepting requests meanwhile
+compute_pool = ComputePool()
+
+def require_film_index():
+    if film_index is None:
+        raise HTTPException(status_code=503, detail='Film index is not available.')
+
+# Without a film index the recommenders serve unfiltered, plain predictions rather than failing,
+# and list the options they couldn't apply under 'unapplied'
+def filter_mask(loaded, filters):
+    if film_index is None:
+        return None
+    catalogue_mask = film_index.mask(**filters.model_dump())
+    return (loaded.film_rows >= 0) & catalogue_mask[loaded.film_rows]
+
+def film_ratings(loaded):
+    if film_index is None:
+        return None
+    return np.where(loaded.film_rows >= 0, film_index.rating[loaded.film_rows], np.nan)
+
+def unapplied(relative, filters):
+    if film_index is not None:
+        return []
+    return [name for name, asked in (('relative', relative), ('filters', filters is not None)) if asked]
+
+def relative_scores(loaded, scores):
+    # Reward films predicted above their Letterboxd average, like the frontend used to do
+    ratings = film_ratings(loaded)
+    if ratings is None:
+        return scores
+    scores = 2 * scores - ratings
+    return np.where(np.isnan(scores), -np.inf, scores)
+
+def require_admin(token):
+    # Closed unless a token is configured, the backend's port is usually published
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail='Admin routes are disabled, set ADMIN_TOKEN to enable them.')
+    if token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='Invalid admin token.')
+
+REGISTRY.register(ServingCollector(registry, result_cache))
 
-with open(f'models/gridsearch/{MODEL_NAME}/model.p', 'rb') as f:
-    model = pickle.load(f)
-    print(f'Model loaded successfully.')
-    
 app = FastAPI()
+app.middleware('http')(instrument_request)
+
+@app.exception_handler(Overloaded)
+async def overloaded(request:Request, e:Overloaded):
+    return JSONResponse({'detail': str(e)}, status_code=503, headers={'Retry-After': RETRY_AFTER})
+
+@app.exception_handler(RequestValidationError)
+async def invalid_request(request:Request, e:RequestValidationError):
+    # The default response echoes the rejected input, which JSON can't carry when it's NaN or infinity
+    errors = [{key: value for key, value in error.items() if key != 'input'} for error in e.errors()]
+    return JSONResponse({'detail': jsonable_encoder(errors)}, status_code=422)
 
 @app.get('/')
 async def root():
-    return {'message': str(model)}
+    return {'message': str(registry.active.factor_model), 'model': registry.active.name}
 
 @app.get('/model_users')
 async def get_model_users():
-    known_users = model.known_users
+    known_users = registry.active.known_users
     return {'count': len(known_users), 'items': known_users}
 
 @app.get('/model_items')
 async def get_model_items():
-    known_items = model.known_items
-    return {'count': len(known_items), 'items': known_items}
-    
+    factor_model = registry.active.factor_model
+    return {'count': factor_model.n_items, 'items': factor_model.item_ids}
+
+def recommend(loaded, user, indices, ratings, excluded, k, relative=False, filters=None):
+    start = time.perf_counter()
+    factor_model = loaded.factor_model
+
+    def predict():
+        with timed('fold_in'):
+            return factor_model.predict(*factor_model.fold_in(indices, ratings))
+
+    if result_cache is None:
+        predictions = predict()
+    else:
+        # The factors' fingerprint tells a model retrained in place apart from the one it replaced
+        key = fingerprint(f'{loaded.name}:{loaded.vocabulary}:{loaded.similarity.source}', indices, ratings)
+        predictions = result_cache.get_or_compute(key, predict)
+
+    with timed('filter'):
+        scores = relative_scores(loaded, predictions) if relative else predictions
+        allowed = allowed_mask(factor_model.n_items, np.concatenate([indices, excluded]))
+        # Films with no Letterboxd rating have no relative score, so they're dropped as in the batch path
+        allowed &= np.isfinite(scores)
+        mask = filter_mask(loaded, filters) if filters is not None else None
+        if mask is not None:
+            allowed &= mask
+    with timed('top_k'):
+        ranked = top_k(scores, k, allowed)
+
+    recs = [{'member':user, 'film':factor_model.item_ids[i], 'index':int(i), 'prediction':float(predictions[i]),
+             'score':float(scores[i])} for i in ranked]
+    loaded.record(time.perf_counter() - start)
+    return recs
+
+def check_indices(factor_model, indices):
+    if len(indices) and (indices.min() < 0 or indices.max() >= factor_model.n_items):
+        raise HTTPException(status_code=422, detail='Item index out of range for this model.')
+    return indices.astype(np.intp)
+
+@app.get('/v1/items')
+async def get_item_vocabulary():
+    factor_model = registry.active.factor_model
+    return {'model': registry.active.name, 'version': registry.active.vocabulary, 'count': factor_model.n_items,
+            'items': factor_model.item_ids, 'film_index': film_index is not None}
+
+@app.post('/v1/recommendations')
+async def post_recommendations(request:RecommendationRequest):
+    loaded = registry.pick()
+
+    def run():
+        with timed('lookup'):
+            positions, indices = loaded.factor_model.lookup(request.items)
+            ratings = np.asarray(request.ratings, dtype=np.float64)[positions]
+            _, excluded = loaded.factor_model.lookup(request.exclude)
+        recs = recommend(loaded, request.user, indices, ratings, excluded, request.k, request.relative,
+                         request.filters)
+        return {'results': recs, 'used_ratings': len(indices), 'model': loaded.name,
+                'unapplied': unapplied(request.relative, request.filters)}
+
+    return await compute_pool.run(run)
+
+@app.post('/v1/recommendations/packed')
+async def post_packed_recommendations(request:Request):
+    active, loaded = registry.active, registry.pick()
+    try:
+        with timed('unpack'):
+            indices, ratings, excluded, k, options = unpack_ratings(await request.body())
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # Packed indices refer to the vocabulary the client fetched, so a candidate only takes its share of
+    # traffic when it shares that vocabulary
+    if loaded.vocabulary != (options.vocabulary or active.vocabulary):
+        loaded = active
+    if options.vocabulary is not None and options.vocabulary != loaded.vocabulary:
+        raise HTTPException(status_code=409, detail='Item vocabulary has changed, fetch /v1/items again.')
+    indices, excluded = check_indices(loaded.factor_model, indices), check_indices(loaded.factor_model, excluded)
+    recs = await compute_pool.run(recommend, loaded, options.user, indices, ratings, excluded, k, options.relative,
+                                  options.filters)
+
+    return {'results': recs, 'used_ratings': len(indices), 'model': loaded.name,
+            'unapplied': unapplied(options.relative, options.filters)}
+
+def request_csr(factor_model, item_lists, value_lists):
+    rows = np.arange(len(item_lists))
+    members = np.repeat(rows, [len(items) for items in item_lists])
+    _, offsets, indices, values = ratings_to_csr(factor_model, members, [i for items in item_lists for i in items],
+                                                 [v for values in value_lists for v in values], users=rows)
+    return offsets, indices, values
+
+@app.post('/v1/recommendations/batch')
+async def post_batch_recommendations(request:BatchRecommendationRequest):
+    loaded = registry.pick()
+    factor_model = loaded.factor_model
+
+    def run():
+        start = time.perf_counter()
+        offsets, indices, ratings = request_csr(factor_model, [u.items for u in request.users],
+                                                [u.ratings for u in request.users])
+        exclude_offsets, exclude_indices, _ = request_csr(factor_model, [u.exclude for u in request.users],
+                                                          [[0.0] * len(u.exclude) for u in request.users])
+        with timed('batch'):
+            items, scores, predictions = recommend_batch(factor_model, offsets, indices, ratings, request.k,
+                                                         exclude_offsets, exclude_indices,
+                                                         film_ratings=film_ratings(loaded) if request.relative else None,
+                                                         allowed=filter_mask(loaded, request.filters) if request.filters else None)
+        loaded.record(time.perf_counter() - start)
+
+        results = []
+        for row, batch_user in enumerate(request.users):
+            found = items[row] >= 0
+            results.append({'member': batch_user.user, 'used_ratings': int(offsets[row + 1] - offsets[row]),
+                            'results': [{'film':factor_model.item_ids[i], 'index':int(i), 'prediction':float(p), 'score':float(s)}
+                                        for i, s, p in zip(items[row][found], scores[row][found], predictions[row][found])]})
+        return {'results': results, 'model': loaded.name, 'unapplied': unapplied(request.relative, request.filters)}
+
+    return await compute_pool.run(run)
+
+@app.get('/v1/recommendations/precomputed/{user}')
+async def get_precomputed_recommendations(user:str, k:int=Query(10, ge=1, le=MAX_K)):
+    loaded = registry.active
+    found = loaded.precomputed.get(user, k) if loaded.precomputed is not None else None
+    if found is None:
+        raise HTTPException(status_code=404, detail=f'No precomputed recommendations for {user}.')
+    items, scores, predictions = found
+    recs = [{'member':user, 'film':loaded.factor_model.item_ids[i], 'index':int(i), 'prediction':float(p), 'score':float(s)}
+            for i, s, p in zip(items, scores, predictions)]
+
+    return {'results': recs, 'model': loaded.name, 'created': loaded.precomputed.manifest.get('created')}
+
+# Kept for older clients, prefer POST /v1/recommendations
 @app.post('/get_recommendations/user={user}&item_list={item_list}&rating_list={rating_list}')
-async def get_recommendations(user:str, item_list:str, rating_list:str):
+async def get_recommendations(user:str, item_list:str, rating_list:str, k:int=-1, exclude_list:str='',
+                              relative:bool=False, filters:Optional[FilmFilters]=None):
+    loaded = registry.pick()
     item_list = item_list.split(',')
-    rating_list = [float(x) for x in rating_list.split(',')]
-    X_new = pd.DataFrame([{'user_id':user, 'item_id':item} for item in item_list])
-    y_new = pd.DataFrame([{'rating':rating} for rating in rating_list])
-    
-    model.update_users(X_new, y_new, lr=0.01, n_epochs=10, verbose=0)
-    recs = model.recommend(user=user, items_known=X_new['item_id'], amount=-1, bound_ratings=True)
-    recs = [{'member':x[0], 'film':x[1], 'prediction':x[2]} for x in recs.values]
-    
-    return {'results': recs}
+    try:
+        rating_list = np.array(rating_list.split(','), dtype=np.float64)
+    except ValueError:
+        raise HTTPException(status_code=422, detail='Ratings must be comma-separated numbers.')
+    if len(item_list) != len(rating_list):
+        raise HTTPException(status_code=422, detail=f'Got {len(item_list)} items but {len(rating_list)} ratings.')
+    if not np.isfinite(rating_list).all():
+        raise HTTPException(status_code=422, detail='Ratings must be finite numbers.')
+
+    positions, indices = loaded.factor_model.lookup(item_list)
+    _, excluded = loaded.factor_model.lookup(exclude_list.split(',') if exclude_list else [])
+    recs = await compute_pool.run(recommend, loaded, user, indices, rating_list[positions], excluded, k, relative,
+                                  filters)
+
+    return {'results': recs, 'unapplied': unapplied(relative, filters)}
+
+def matrix_json(matrix):
+    # JSON has no NaN, so undefined pairs go out as null
+    return np.where(np.isnan(matrix), None, matrix.astype(object)).tolist()
+
+@app.post('/v1/compatibility')
+async def post_compatibility(request:CompatibilityRequest):
+    # Indices refer to the active model's vocabulary, like packed recommendations
+    loaded = registry.active
+    if request.vocabulary is not None and request.vocabulary != loaded.vocabulary:
+        raise HTTPException(status_code=409, detail='Item vocabulary has changed, fetch /v1/items again.')
+
+    def run():
+        offsets = np.zeros(len(request.users) + 1, dtype=np.intp)
+        np.cumsum([len(u.indices) for u in request.users], out=offsets[1:])
+        indices = check_indices(loaded.factor_model, np.array([i for u in request.users for i in u.indices], dtype=np.int64))
+        ratings = np.array([r for u in request.users for r in u.ratings], dtype=np.float64)
+        with timed('compatibility'):
+            results = compatibility(loaded.factor_model, offsets, indices, ratings, request.min_overlap)
+        return {'users': [u.user for u in request.users], 'rated': results['rated'].tolist(),
+                'overlap': results['overlap'].tolist(), 'jaccard': results['jaccard'].tolist(),
+                'correlation': matrix_json(results['correlation']), 'rms_difference': matrix_json(results['rms_difference']),
+                'latent_cosine': matrix_json(results['latent_cosine']), 'model': loaded.name}
+
+    return await compute_pool.run(run)
+
+@app.get('/similar_items/{film}')
+async def similar_items(film:str, k:int=Query(10, ge=1, le=MAX_K), mode:Literal['exact', 'approximate']='approximate',
+                        n_probe:int=Query(8, ge=1)):
+    loaded = registry.active
+    index = loaded.factor_model.item_index.get(film)
+    if index is None:
+        raise HTTPException(status_code=404, detail=f'Film {film} is not known to the model.')
+
+    if mode == 'exact':
+        items, scores = await compute_pool.run(loaded.similarity.exact, index, k)
+        items, scores = items[0], scores[0]
+    else:
+        items, scores = await compute_pool.run(loaded.similarity.approximate, index, k, n_probe)
+    results = [{'film':loaded.factor_model.item_ids[i], 'similarity':float(s)} for i, s in zip(items, scores)]
+
+    return {'film': film, 'mode': mode, 'results': results}
+
+@app.post('/filter_items')
+async def filter_items(request:FilterRequest):
+    require_film_index()
+
+    def run():
+        with timed('filter_items'):
+            rows = film_index.locate(request.items)
+            keep = (rows >= 0) & film_index.mask(**request.filters.model_dump())[rows]
+        return {'items': [item for item, kept in zip(request.items, keep) if kept]}
+
+    return await compute_pool.run(run)
+
+@app.get('/metrics')
+async def metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    # Under several workers, sum what every worker wrote to the shared directory. The per-model and result
+    # cache counters only describe whichever worker answers the scrape, so they're left out here.
+    collectors = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collectors)
+    return Response(generate_latest(collectors), media_type=CONTENT_TYPE_LATEST)
+
+@app.get('/admin/models')
+async def list_models(x_admin_token:Optional[str]=Header(None)):
+    require_admin(x_admin_token)
+    return registry.describe()
+
+@app.get('/admin/cache')
+async def describe_result_cache(x_admin_token:Optional[str]=Header(None)):
+    require_admin(x_admin_token)
+    return result_cache.metrics() if result_cache is not None else {'enabled': False}
+
+@app.delete('/admin/cache')
+async def clear_result_cache(x_admin_token:Optional[str]=Header(None)):
+    require_admin(x_admin_token)
+    if result_cache is not None:
+        result_cache.clear()
+    return {'cleared': result_cache is not None}
+
+@app.post('/admin/models/{name}/activate', status_code=202)
+async def activate_model(name:str, x_admin_token:Optional[str]=Header(None)):
+    require_admin(x_admin_token)
+    try:
+        registry.model_dir(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # Like the candidate, every worker's watch swaps to it from the ACTIVE file
+    registry.write_active(name)
+    if MODEL_WATCH_INTERVAL <= 0:
+        registry.in_background(registry.activate, name)
+    return {'loading': name}
+
+@app.post('/admin/models/{name}/candidate', status_code=202)
+async def set_candidate_model(name:str, share:float=0.1, x_admin_token:Optional[str]=Header(None)):
+    require_admin(x_admin_token)
+    if not 0 <= share <= 1:
+        raise HTTPException(status_code=422, detail='Candidate share must be between 0 and 1.')
+    try:
+        registry.model_dir(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # Every worker's watch loads it from the CANDIDATE file, this one included
+    registry.write_candidate(name, share)
+    if MODEL_WATCH_INTERVAL <= 0:
+        registry.in_background(registry.set_candidate, name, share)
+    return {'loading': name, 'share': share}
+
+@app.delete('/admin/models/candidate')
+async def clear_candidate_model(x_admin_token:Optional[str]=Header(None)):
+    require_admin(x_admin_token)
+    registry.write_candidate(None)
+    registry.clear_candidate()
+    return {'candidate': None}
 
 if __name__ == '__main__':
     uvicorn.run('main:app', host='0.0.0.0', port=8000)
\ No newline at end of file
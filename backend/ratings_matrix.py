@@ -0,0 +1,261 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from numpy.lib.format import open_memmap
+
+# Ratings handled at once while building. Everything bigger than this lives in memory-mapped files.
+CHUNK_ROWS = int(os.environ.get('TRAINING_CHUNK_ROWS', 2000000))
+MANIFEST_NAME = 'matrix.json'
+ARRAY_FILES = ('users', 'items', 'user_offsets', 'user_items', 'user_ratings', 'item_offsets', 'item_users',
+               'item_ratings', 'test_users', 'test_items', 'test_ratings')
+
+
+def open_ratings(source):
+    """A dataset over a directory of Parquet chunks, one Parquet file or a CSV, with member, film and rating."""
+    return ds.dataset(source, format='csv' if str(source).endswith('.csv') else 'parquet')
+
+
+def encode(dataset, scratch_dir, chunk_rows=CHUNK_ROWS):
+    """Stream the ratings into int32 member and film codes in first-seen order, dropping missing ratings.
+
+    Only one chunk of the source is in memory at a time, plus the dictionaries of distinct IDs.
+    """
+    n_rows = dataset.count_rows()
+    members = open_memmap(os.path.join(scratch_dir, 'members.npy'), mode='w+', dtype=np.int32, shape=(n_rows,))
+    films = open_memmap(os.path.join(scratch_dir, 'films.npy'), mode='w+', dtype=np.int32, shape=(n_rows,))
+    ratings = open_memmap(os.path.join(scratch_dir, 'ratings.npy'), mode='w+', dtype=np.float32, shape=(n_rows,))
+    member_codes, film_codes = {}, {}
+
+    def codes(values, known):
+        local, uniques = pd.factorize(values)
+        mapping = np.fromiter((known.setdefault(str(x), len(known)) for x in uniques), dtype=np.int32,
+                              count=len(uniques))
+        return mapping[local]
+
+    filled = 0
+    for batch in dataset.to_batches(columns=['member', 'film', 'rating'], batch_size=chunk_rows):
+        frame = batch.to_pandas()
+        frame = frame[frame['rating'].notna() & frame['member'].notna() & frame['film'].notna()]
+        stop = filled + len(frame)
+        members[filled:stop] = codes(frame['member'], member_codes)
+        films[filled:stop] = codes(frame['film'], film_codes)
+        ratings[filled:stop] = frame['rating'].to_numpy(dtype=np.float32)
+        filled = stop
+
+    return members[:filled], films[:filled], ratings[:filled], list(member_codes), list(film_codes)
+
+
+def chunked_bincount(codes, length, chunk_rows=CHUNK_ROWS):
+    counts = np.zeros(length, dtype=np.int64)
+    for start in range(0, len(codes), chunk_rows):
+        counts += np.bincount(codes[start:start + chunk_rows], minlength=length)
+    return counts
+
+
+def counting_sort(chunks, counts, out_offsets, out_columns, out_values):
+    """Scatter (row, column, value) chunks into CSR arrays whose row sizes are known up front.
+
+    Each row's entries keep the order they arrived in, so later duplicates come after earlier ones.
+    """
+    out_offsets[0] = 0
+    np.cumsum(counts, out=out_offsets[1:])
+    cursor = np.array(out_offsets[:-1])
+    for rows, columns, values in chunks:
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        first = np.searchsorted(rows, rows, side='left')
+        positions = cursor[rows] + (np.arange(len(rows)) - first)
+        out_columns[positions] = columns[order]
+        out_values[positions] = values[order]
+        cursor += np.bincount(rows, minlength=len(cursor))
+
+
+def row_blocks(offsets, block_rows):
+    """(first, last) row ranges holding about block_rows entries each, never splitting a row."""
+    start, n_rows = 0, len(offsets) - 1
+    while start < n_rows:
+        stop = int(np.searchsorted(offsets, offsets[start] + block_rows, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        yield start, stop
+        start = stop
+
+
+def dedupe_and_split(offsets, columns, values, test_fraction, rng, chunk_rows=CHUNK_ROWS):
+    """Sort each row by column, keep only the last rating of a repeated pair and hold out a test sample.
+
+    Rows are compacted in place, which is safe because nothing is written past what was read.
+    Returns the number of training entries kept, the new offsets and (rows, columns, values) held out.
+    """
+    new_offsets = np.zeros_like(offsets)
+    written = 0
+    held_out = [(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))]
+    for start, stop in row_blocks(offsets, chunk_rows):
+        lo, hi = offsets[start], offsets[stop]
+        block_columns, block_values = np.array(columns[lo:hi]), np.array(values[lo:hi])
+        rows = np.repeat(np.arange(start, stop), np.diff(offsets[start:stop + 1]))
+
+        order = np.lexsort((np.arange(hi - lo), block_columns, rows))
+        rows, block_columns, block_values = rows[order], block_columns[order], block_values[order]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (block_columns[1:] != block_columns[:-1])
+        test = last & (rng.random(len(rows)) < test_fraction)
+        train = last & ~test
+
+        held_out.append((rows[test], block_columns[test], block_values[test]))
+        kept = int(train.sum())
+        columns[written:written + kept] = block_columns[train]
+        values[written:written + kept] = block_values[train]
+        written += kept
+        new_offsets[start + 1:stop + 1] = written - kept + np.cumsum(np.bincount(rows[train] - start,
+                                                                                minlength=stop - start))
+
+    return written, new_offsets, tuple(np.concatenate(parts) for parts in zip(*held_out))
+
+
+def copy_prefix(source, path, length, chunk_rows=CHUNK_ROWS):
+    target = open_memmap(path, mode='w+', dtype=source.dtype, shape=(length,))
+    for start in range(0, length, chunk_rows):
+        target[start:start + chunk_rows] = source[start:min(start + chunk_rows, length)]
+    target.flush()
+
+
+def build_matrix(source, matrix_dir, n_films=None, min_user_ratings=1, test_fraction=0.02, seed=0,
+                 chunk_rows=CHUNK_ROWS):
+    """Turn crawled ratings into a RatingsMatrix in matrix_dir, keeping the n_films most rated films.
+
+    Peak memory is a few chunks of chunk_rows ratings plus the per-member and per-film arrays,
+    whatever the number of ratings. Scratch files are written next to the matrix and removed.
+    """
+    start_time = time.perf_counter()
+    os.makedirs(matrix_dir, exist_ok=True)
+    scratch_dir = os.path.join(matrix_dir, 'scratch')
+    os.makedirs(scratch_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    members, films, ratings, member_ids, film_ids = encode(open_ratings(source), scratch_dir, chunk_rows)
+
+    film_counts = chunked_bincount(films, len(film_ids), chunk_rows=chunk_rows)
+    kept_films = np.sort(np.argsort(-film_counts, kind='stable')[:n_films]) if n_films else np.arange(len(film_ids))
+    film_map = np.full(len(film_ids), -1, dtype=np.int32)
+    film_map[kept_films] = np.arange(len(kept_films))
+
+    # Members are counted on the kept films only, so min_user_ratings means ratings the model will see
+    member_counts = np.zeros(len(member_ids), dtype=np.int64)
+    for lo in range(0, len(members), chunk_rows):
+        known = film_map[films[lo:lo + chunk_rows]] >= 0
+        member_counts += np.bincount(members[lo:lo + chunk_rows][known], minlength=len(member_ids))
+    kept_members = np.flatnonzero(member_counts >= max(min_user_ratings, 1))
+    member_map = np.full(len(member_ids), -1, dtype=np.int32)
+    member_map[kept_members] = np.arange(len(kept_members))
+    n_users, n_items = len(kept_members), len(kept_films)
+
+    # The arrays are passed in rather than closed over, since they're deleted before the scratch files go
+    def user_chunks(members, films, ratings):
+        for lo in range(0, len(members), chunk_rows):
+            rows, columns = member_map[members[lo:lo + chunk_rows]], film_map[films[lo:lo + chunk_rows]]
+            keep = (rows >= 0) & (columns >= 0)
+            yield rows[keep], columns[keep], np.asarray(ratings[lo:lo + chunk_rows])[keep]
+
+    n_ratings = int(member_counts[kept_members].sum())
+    user_offsets = np.zeros(n_users + 1, dtype=np.int64)
+    user_items = open_memmap(os.path.join(scratch_dir, 'user_items.npy'), mode='w+', dtype=np.int32, shape=(n_ratings,))
+    user_ratings = open_memmap(os.path.join(scratch_dir, 'user_ratings.npy'), mode='w+', dtype=np.float32,
+                               shape=(n_ratings,))
+    counting_sort(user_chunks(members, films, ratings), member_counts[kept_members], user_offsets, user_items, user_ratings)
+    n_train, user_offsets, (test_users, test_items, test_ratings) = dedupe_and_split(
+        user_offsets, user_items, user_ratings, test_fraction, rng, chunk_rows)
+
+    def item_chunks(user_offsets, user_items, user_ratings):
+        for first, last in row_blocks(user_offsets, chunk_rows):
+            lo, hi = user_offsets[first], user_offsets[last]
+            rows = np.repeat(np.arange(first, last, dtype=np.int32), np.diff(user_offsets[first:last + 1]))
+            yield np.asarray(user_items[lo:hi]), rows, np.asarray(user_ratings[lo:hi])
+
+    item_counts = chunked_bincount(user_items[:n_train], n_items, chunk_rows=chunk_rows)
+    item_offsets = np.zeros(n_items + 1, dtype=np.int64)
+    item_users = open_memmap(os.path.join(matrix_dir, 'item_users.npy'), mode='w+', dtype=np.int32, shape=(n_train,))
+    item_ratings = open_memmap(os.path.join(matrix_dir, 'item_ratings.npy'), mode='w+', dtype=np.float32,
+                               shape=(n_train,))
+    counting_sort(item_chunks(user_offsets, user_items, user_ratings), item_counts, item_offsets, item_users, item_ratings)
+    item_users.flush()
+    item_ratings.flush()
+
+    copy_prefix(user_items, os.path.join(matrix_dir, 'user_items.npy'), n_train, chunk_rows)
+    copy_prefix(user_ratings, os.path.join(matrix_dir, 'user_ratings.npy'), n_train, chunk_rows)
+    arrays = {'users': np.array(member_ids, dtype=str)[kept_members], 'items': np.array(film_ids, dtype=str)[kept_films],
+              'user_offsets': user_offsets, 'item_offsets': item_offsets, 'test_users': test_users.astype(np.int32),
+              'test_items': test_items.astype(np.int32), 'test_ratings': test_ratings.astype(np.float32)}
+    for name, array in arrays.items():
+        np.save(os.path.join(matrix_dir, f'{name}.npy'), array)
+
+    train_sum, low, high = 0.0, np.inf, -np.inf
+    for lo in range(0, n_train, chunk_rows):
+        chunk = np.asarray(item_ratings[lo:lo + chunk_rows], dtype=np.float64)
+        train_sum, low, high = train_sum + chunk.sum(), min(low, chunk.min()), max(high, chunk.max())
+    del members, films, ratings, user_items, user_ratings, item_users, item_ratings
+    for name in os.listdir(scratch_dir):
+        os.remove(os.path.join(scratch_dir, name))
+    os.rmdir(scratch_dir)
+
+    manifest = {
+        'source': os.path.abspath(source),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'n_users': n_users,
+        'n_items': n_items,
+        'n_train': n_train,
+        'n_test': len(test_ratings),
+        'duplicates_dropped': n_ratings - n_train - len(test_ratings),
+        'global_mean': train_sum / n_train if n_train else 0.0,
+        'min_rating': float(low) if n_train else 0.0,
+        'max_rating': float(high) if n_train else 5.0,
+        'test_fraction': test_fraction,
+        'seed': seed,
+        'build_seconds': time.perf_counter() - start_time,
+    }
+    # Written last, so a half-built matrix is never loaded
+    with open(os.path.join(matrix_dir, MANIFEST_NAME + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(matrix_dir, MANIFEST_NAME + '.tmp'), os.path.join(matrix_dir, MANIFEST_NAME))
+
+    return RatingsMatrix.load(matrix_dir)
+
+
+class RatingsMatrix:
+    """Training ratings as int32 CSR arrays by user and by item, plus held-out test ratings.
+
+    user_items/user_ratings[user_offsets[u]:user_offsets[u + 1]] are user u's films and ratings,
+    sorted by film, and item_users/item_ratings hold the same ratings grouped by film.
+    """
+
+    def __init__(self, arrays, manifest):
+        self.manifest = manifest
+        for name in ARRAY_FILES:
+            setattr(self, name, arrays[name])
+
+    def __repr__(self):
+        return (f'RatingsMatrix(n_users={self.n_users}, n_items={self.n_items}, n_train={len(self.user_items)}, '
+                f'n_test={len(self.test_ratings)})')
+
+    @property
+    def n_users(self):
+        return len(self.user_offsets) - 1
+
+    @property
+    def n_items(self):
+        return len(self.item_offsets) - 1
+
+    @classmethod
+    def exists(cls, matrix_dir):
+        return os.path.exists(os.path.join(matrix_dir, MANIFEST_NAME))
+
+    @classmethod
+    def load(cls, matrix_dir, mmap=True):
+        with open(os.path.join(matrix_dir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(os.path.join(matrix_dir, f'{name}.npy'), mmap_mode='r' if mmap else None)
+                  for name in ARRAY_FILES}
+        return cls(arrays, manifest)
@@ -0,0 +1,242 @@
+import json
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+
+from artifacts import has_artifacts, load_artifacts, load_users, vocabulary_version
+from batch import PrecomputedRecommendations
+from engine import FactorModel
+from similarity import SimilarityIndex
+
+MODELS_ROOT = 'models/gridsearch'
+# Writing a model name into this file makes every worker swap to it
+ACTIVE_MODEL_FILE = 'ACTIVE'
+# Holds the candidate model and its share of traffic as JSON, read by every worker like ACTIVE
+CANDIDATE_MODEL_FILE = 'CANDIDATE'
+
+
+def read_stats(model_dir):
+    try:
+        with open(os.path.join(model_dir, 'model_stats.json'), 'r') as f:
+            contents = f.read()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return json.loads(contents) if contents.strip() else {}
+
+
+def discover_models(root=MODELS_ROOT):
+    models = {}
+    for name in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, name)):
+            continue
+        stats = read_stats(os.path.join(root, name))
+        if stats is not None:
+            models[name] = stats
+    return models
+
+
+class LoadedModel:
+
+    def __init__(self, name, factor_model, stats, known_users, film_rows=None, similarity=None, vocabulary=None,
+                 precomputed=None):
+        self.name = name
+        self.factor_model = factor_model
+        self.vocabulary = vocabulary or vocabulary_version(factor_model.item_ids)
+        self.precomputed = precomputed
+        self.similarity = similarity
+        self.stats = stats
+        self.known_users = known_users
+        self.film_rows = film_rows
+        self.loaded_at = time.time()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @classmethod
+    def load(cls, model_dir, film_index=None):
+        vocabulary = None
+        if has_artifacts(model_dir):
+            factor_model, manifest = load_artifacts(model_dir)
+            known_users = load_users(model_dir).tolist()
+            vocabulary = manifest.get('vocabulary_version')
+        else:
+            with open(os.path.join(model_dir, 'model.p'), 'rb') as f:
+                model = pickle.load(f)
+            factor_model = FactorModel.from_kernel_mf(model)
+            known_users = list(model.known_users)
+
+        film_rows = film_index.locate(factor_model.item_ids) if film_index is not None else None
+        similarity = SimilarityIndex.load_or_build(model_dir, factor_model.item_factors)
+        vocabulary = vocabulary or vocabulary_version(factor_model.item_ids)
+        precomputed = PrecomputedRecommendations.load(model_dir, vocabulary)
+        name = os.path.basename(os.path.normpath(model_dir))
+        return cls(name, factor_model, read_stats(model_dir) or {}, known_users, film_rows, similarity, vocabulary,
+                   precomputed)
+
+    def record(self, seconds):
+        with self._lock:
+            self.requests += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def latency(self):
+        with self._lock:
+            mean = self.total_seconds / self.requests if self.requests else 0.0
+            return {'requests': self.requests, 'mean_seconds': mean, 'max_seconds': self.max_seconds}
+
+
+class ModelRegistry:
+    """Keeps the serving model and an optional candidate, swapping them without dropping requests.
+
+    Requests grab a LoadedModel reference once and keep using it, so replacing the
+    attributes below is the whole swap.
+    """
+
+    def __init__(self, root=MODELS_ROOT, film_index=None):
+        self.root = root
+        self.film_index = film_index
+        self.active = None
+        self.candidate = None
+        self.candidate_share = 0.0
+        self.loading = {}
+        self._lock = threading.Lock()
+
+    def model_dir(self, name):
+        model_dir = os.path.join(self.root, name)
+        if os.path.dirname(os.path.normpath(model_dir)) != os.path.normpath(self.root) or read_stats(model_dir) is None:
+            raise KeyError(f'No model named {name} under {self.root}.')
+        return model_dir
+
+    def load(self, name):
+        return LoadedModel.load(self.model_dir(name), self.film_index)
+
+    def activate(self, name):
+        loaded = self.load(name)
+        with self._lock:
+            self.active = loaded
+            if self.candidate is not None and self.candidate.name == name:
+                self.candidate, self.candidate_share = None, 0.0
+        print(f'Now serving model {name}.')
+        return loaded
+
+    def set_candidate(self, name, share):
+        if not 0 <= share <= 1:
+            raise ValueError('Candidate share must be between 0 and 1.')
+        loaded = self.load(name)
+        with self._lock:
+            self.candidate, self.candidate_share = loaded, share
+        return loaded
+
+    def clear_candidate(self):
+        with self._lock:
+            self.candidate, self.candidate_share = None, 0.0
+
+    def write_active(self, name):
+        """Publish the model every worker's watch should swap to."""
+        with tempfile.NamedTemporaryFile('w', dir=self.root, delete=False) as f:
+            f.write(name)
+        os.replace(f.name, os.path.join(self.root, ACTIVE_MODEL_FILE))
+
+    def write_candidate(self, name, share=0.0):
+        """Publish the candidate to every worker's watch, or withdraw it when name is None."""
+        path = os.path.join(self.root, CANDIDATE_MODEL_FILE)
+        with tempfile.NamedTemporaryFile('w', dir=self.root, delete=False) as f:
+            json.dump({'name': name, 'share': share} if name else {}, f)
+        os.replace(f.name, path)
+
+    def read_candidate(self):
+        try:
+            with open(os.path.join(self.root, CANDIDATE_MODEL_FILE), 'r') as f:
+                candidate = json.load(f)
+        except (FileNotFoundError, ValueError):
+            candidate = {}
+        return candidate.get('name'), float(candidate.get('share', 0.0))
+
+    def apply_candidate(self, name, share):
+        if name is None:
+            self.clear_candidate()
+        elif self.active is not None and self.active.name == name:
+            # Promoted since it was published, activate already dropped it as a candidate
+            pass
+        elif self.candidate is not None and self.candidate.name == name:
+            with self._lock:
+                self.candidate_share = share
+        else:
+            self.loading[name] = 'loading'
+            try:
+                self.set_candidate(name, share)
+                self.loading[name] = 'done'
+            except Exception as e:
+                self.loading[name] = f'failed: {e}'
+                print(f'Could not load candidate model {name}: {e}')
+
+    def in_background(self, action, name, *args):
+        """Run activate/set_candidate on a thread so the caller isn't blocked by the load."""
+        def run():
+            try:
+                action(name, *args)
+                self.loading[name] = 'done'
+            except Exception as e:
+                self.loading[name] = f'failed: {e}'
+                print(f'Loading model {name} failed: {e}')
+
+        self.model_dir(name)
+        self.loading[name] = 'loading'
+        threading.Thread(target=run, daemon=True).start()
+
+    def pick(self):
+        active, candidate, share = self.active, self.candidate, self.candidate_share
+        if candidate is not None and random.random() < share:
+            return candidate
+        return active
+
+    def watch(self, interval=5.0):
+        """Poll the ACTIVE and CANDIDATE files and follow them whenever they change."""
+        path = os.path.join(self.root, ACTIVE_MODEL_FILE)
+
+        def poll():
+            last_seen = None
+            last_candidate = None
+            while True:
+                try:
+                    with open(path, 'r') as f:
+                        name = f.read().strip()
+                except FileNotFoundError:
+                    name = None
+                if name and name != last_seen:
+                    last_seen = name
+                    if self.active is None or self.active.name != name:
+                        self.loading[name] = 'loading'
+                        try:
+                            self.activate(name)
+                            self.loading[name] = 'done'
+                        except Exception as e:
+                            self.loading[name] = f'failed: {e}'
+                            print(f'Could not swap to model {name}: {e}')
+                candidate = self.read_candidate()
+                if candidate != last_candidate:
+                    last_candidate = candidate
+                    self.apply_candidate(*candidate)
+                time.sleep(interval)
+
+        threading.Thread(target=poll, daemon=True).start()
+
+    def describe(self):
+        active, candidate = self.active, self.candidate
+        models = []
+        for name, stats in discover_models(self.root).items():
+            entry = {'name': name, 'stats': stats, 'status': self.loading.get(name)}
+            for role, loaded in (('active', active), ('candidate', candidate)):
+                if loaded is not None and loaded.name == name:
+                    entry['role'] = role
+                    entry['vocabulary'] = loaded.vocabulary
+                    entry['latency'] = loaded.latency()
+            models.append(entry)
+        return {'active': active.name if active else None,
+                'candidate': candidate.name if candidate else None,
+                'candidate_share': self.candidate_share,
+                'models': models}
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+RESULT_CACHE_BYTES = int(os.environ.get('RESULT_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+def fingerprint(model, indices, ratings):
+    """Stable key for a model and a user's rating set, independent of the order ratings arrive in."""
+    indices = np.asarray(indices, dtype=np.int64)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    order = np.lexsort((ratings, indices))
+    digest = hashlib.blake2b(model.encode(), digest_size=16)
+    digest.update(indices[order].tobytes())
+    digest.update(ratings[order].tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Bounded LRU of prediction vectors, so re-runs with other filters skip the fold-in."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        # Cached arrays are shared between requests, so nobody may write to them
+        value.flags.writeable = False
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self.entries[key] = value
+            self.bytes += value.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.stats['evictions'] += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
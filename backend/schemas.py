@@ -0,0 +1,126 @@
+import json
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field, FiniteFloat, model_validator
+
+MAX_K = 1000
+MAX_BATCH_USERS = 1000
+# Compatibility is all pairs, so the group is kept to what a watch party could plausibly be
+MAX_GROUP_USERS = 100
+
+# Packed request layout, little-endian: magic, n_ratings, n_exclude, k, then
+# int32 item indices, float32 ratings and int32 excluded indices. Anything left
+# over is an optional UTF-8 JSON object of PackedOptions.
+PACKED_MAGIC = b'LBR1'
+PACKED_HEADER = struct.Struct('<4sIIi')
+
+
+class FilmFilters(BaseModel):
+    year_range: Optional[Tuple[float, float]] = None
+    runtime_range: Optional[Tuple[float, float]] = None
+    popularity_range: Optional[Tuple[float, float]] = None
+    rating_range: Optional[Tuple[float, float]] = None
+    country_specification: Optional[str] = None
+    include_genres: Optional[List[str]] = None
+
+
+class FilterRequest(BaseModel):
+    items: List[str]
+    filters: FilmFilters
+
+
+class PackedOptions(BaseModel):
+    user: str = ''
+    # Version of the item vocabulary the packed indices were encoded with, from GET /v1/items
+    vocabulary: Optional[str] = None
+    relative: bool = False
+    filters: Optional[FilmFilters] = None
+
+
+class RecommendationRequest(PackedOptions):
+    items: List[str]
+    # NaN and infinity parse as JSON numbers but would poison the fold-in
+    ratings: List[FiniteFloat]
+    exclude: List[str] = []
+    k: int = Field(10, ge=1, le=MAX_K)
+
+    @model_validator(mode='after')
+    def check_lengths(self):
+        if len(self.items) != len(self.ratings):
+            raise ValueError(f'Got {len(self.items)} items but {len(self.ratings)} ratings.')
+        return self
+
+
+class BatchUser(BaseModel):
+    user: str
+    items: List[str]
+    ratings: List[FiniteFloat]
+    exclude: List[str] = []
+
+    @model_validator(mode='after')
+    def check_lengths(self):
+        if len(self.items) != len(self.ratings):
+            raise ValueError(f'Got {len(self.items)} items but {len(self.ratings)} ratings for {self.user}.')
+        return self
+
+
+class BatchRecommendationRequest(BaseModel):
+    users: List[BatchUser] = Field(..., max_length=MAX_BATCH_USERS)
+    k: int = Field(10, ge=1, le=MAX_K)
+    relative: bool = False
+    filters: Optional[FilmFilters] = None
+
+
+class GroupMember(BaseModel):
+    user: str
+    # Indices into the item vocabulary, from GET /v1/items
+    indices: List[int]
+    ratings: List[FiniteFloat]
+
+    @model_validator(mode='after')
+    def check_lengths(self):
+        if len(self.indices) != len(self.ratings):
+            raise ValueError(f'Got {len(self.indices)} indices but {len(self.ratings)} ratings for {self.user}.')
+        return self
+
+
+class CompatibilityRequest(BaseModel):
+    users: List[GroupMember] = Field(..., min_length=2, max_length=MAX_GROUP_USERS)
+    vocabulary: Optional[str] = None
+    min_overlap: int = Field(5, ge=2)
+
+
+def pack_ratings(indices, ratings, exclude=(), k=10, options=None):
+    indices = np.asarray(indices, dtype='<i4')
+    ratings = np.asarray(ratings, dtype='<f4')
+    exclude = np.asarray(exclude, dtype='<i4')
+    tail = json.dumps(options).encode() if options else b''
+    header = PACKED_HEADER.pack(PACKED_MAGIC, len(indices), len(exclude), k)
+    return header + indices.tobytes() + ratings.tobytes() + exclude.tobytes() + tail
+
+
+def unpack_ratings(body):
+    if len(body) < PACKED_HEADER.size:
+        raise ValueError('Packed payload is shorter than its header.')
+    magic, n_ratings, n_exclude, k = PACKED_HEADER.unpack_from(body)
+    if magic != PACKED_MAGIC:
+        raise ValueError('Packed payload has an unknown format.')
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f'k must be between 1 and {MAX_K}.')
+
+    offset = PACKED_HEADER.size
+    arrays_end = offset + 4 * (2 * n_ratings + n_exclude)
+    if len(body) < arrays_end:
+        raise ValueError('Packed payload is truncated.')
+    indices = np.frombuffer(body, dtype='<i4', count=n_ratings, offset=offset)
+    ratings = np.frombuffer(body, dtype='<f4', count=n_ratings, offset=offset + 4 * n_ratings)
+    exclude = np.frombuffer(body, dtype='<i4', count=n_exclude, offset=offset + 8 * n_ratings)
+    if not np.isfinite(ratings).all():
+        raise ValueError('Ratings must be finite numbers.')
+
+    tail = body[arrays_end:]
+    options = PackedOptions.model_validate_json(tail) if tail else PackedOptions()
+
+    return indices, ratings, exclude, k, options
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+VECTORS_FILE = 'similarity_vectors.npy'
+IVF_FILE = 'similarity_ivf.npz'
+
+
+def factors_fingerprint(item_factors):
+    """Identifies the factors an index was built from, so a retrained model never reuses a stale one."""
+    item_factors = np.ascontiguousarray(item_factors)
+    digest = hashlib.sha1(str((item_factors.shape, item_factors.dtype.str)).encode())
+    digest.update(item_factors.data)
+    return digest.hexdigest()[:16]
+
+
+def normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(vectors / norms)
+
+
+def _merge_top(best_scores, best_items, scores, items, k):
+    scores = np.concatenate([best_scores, scores], axis=1)
+    items = np.concatenate([best_items, items], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        items = np.take_along_axis(items, keep, axis=1)
+    return scores, items
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, block_size=8192, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    assignment = np.zeros(len(vectors), dtype=np.int32)
+
+    for _ in range(n_iter):
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start:start + block_size]
+            assignment[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), empty.sum(), replace=False)]
+        centroids = normalise(sums)
+
+    return centroids, assignment
+
+
+class SimilarityIndex:
+    """Cosine nearest neighbours over item factors, exact or through an inverted-file (IVF) index."""
+
+    def __init__(self, vectors, centroids, list_offsets, list_items, source=None):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.source = source
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, item_factors, n_lists=None, seed=0):
+        vectors = normalise(item_factors)
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        centroids, assignment = spherical_kmeans(vectors, min(n_lists, len(vectors)), seed=seed)
+        list_items = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=list_offsets[1:])
+        return cls(vectors, centroids, list_offsets, list_items, factors_fingerprint(item_factors))
+
+    @classmethod
+    def load(cls, model_dir):
+        vectors = np.load(os.path.join(model_dir, VECTORS_FILE), mmap_mode='r')
+        with np.load(os.path.join(model_dir, IVF_FILE)) as ivf:
+            source = str(ivf['source']) if 'source' in ivf.files else None
+            return cls(vectors, ivf['centroids'], ivf['list_offsets'], ivf['list_items'], source)
+
+    @classmethod
+    def load_or_build(cls, model_dir, item_factors):
+        try:
+            index = cls.load(model_dir)
+            if index.source == factors_fingerprint(item_factors) and index.vectors.shape == item_factors.shape:
+                return index
+        except (OSError, KeyError, ValueError):
+            pass
+        index = cls.build(item_factors)
+        try:
+            index.save(model_dir)
+        except OSError as e:
+            print(f'Could not persist similarity index to {model_dir}: {e}')
+        return index
+
+    def save(self, model_dir):
+        # Each process writes its own temporary files, so workers building at once never mix their
+        # writes and workers starting up never read half a file
+        with tempfile.NamedTemporaryFile(dir=model_dir, suffix='.npy', delete=False) as f:
+            np.save(f, self.vectors)
+        os.replace(f.name, os.path.join(model_dir, VECTORS_FILE))
+        with tempfile.NamedTemporaryFile(dir=model_dir, suffix='.npz', delete=False) as f:
+            np.savez(f, centroids=self.centroids, list_offsets=self.list_offsets, list_items=self.list_items,
+                     source=np.array(self.source or ''))
+        os.replace(f.name, os.path.join(model_dir, IVF_FILE))
+
+    def exact(self, queries, k=10, block_size=8192):
+        """Top k neighbours for each query index, scanning the items in blocks to bound memory."""
+        queries = np.atleast_1d(np.asarray(queries, dtype=np.intp))
+        # A query is never its own neighbour, so past n_items - 1 its -inf column would be kept
+        k = min(k, len(self.vectors) - 1)
+        query_vectors = self.vectors[queries]
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_items = np.zeros((len(queries), 0), dtype=np.intp)
+
+        for start in range(0, len(self.vectors), block_size):
+            scores = query_vectors @ self.vectors[start:start + block_size].T
+            items = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            scores = np.where(items == queries[:, None], -np.inf, scores)
+            best_scores, best_items = _merge_top(best_scores, best_items, scores, items, k)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_items, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def approximate(self, query, k=10, n_probe=8):
+        """Top k neighbours of one item, only scoring the items in the n_probe closest IVF lists."""
+        query_vector = self.vectors[query]
+        n_probe = min(n_probe, self.n_lists)
+        probes = np.argpartition(-(self.centroids @ query_vector), n_probe - 1)[:n_probe]
+        candidates = np.concatenate([self.list_items[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probes])
+        candidates = candidates[candidates != query]
+
+        scores = self.vectors[candidates] @ query_vector
+        k = min(k, len(candidates))
+        if k < len(candidates):
+            keep = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.argsort(-scores, kind='stable')
+        return candidates[order], scores[order]
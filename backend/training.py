@@ -0,0 +1,153 @@
+"""Train a servable model from crawled ratings without holding them all in memory.
+
+    python training.py data/ratings --films 5000 --factors 50 --epochs 10
+    python training.py --matrix-dir data/ratings_matrix --factors 100   # retrain on a built matrix
+
+The ratings (Parquet chunks from frontend/crawl_ratings.py, or a CSV) are turned into CSR
+matrices on disk, the model is fitted by alternating least squares over blocks of members and
+films, and the artifacts plus model_stats.json land in models/gridsearch/<name>/.
+"""
+import argparse
+import json
+import os
+import resource
+import time
+
+import numpy as np
+
+from artifacts import export_factor_model, write_json
+from engine import FactorModel
+from ratings_matrix import CHUNK_ROWS, RatingsMatrix, build_matrix, row_blocks
+
+MATRIX_DIR = 'data/ratings_matrix'
+MEMORY_BUDGET = int(os.environ.get('TRAINING_MEMORY_BUDGET', 256 * 1024 ** 2))
+
+
+def peak_memory_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def solve_rows(fixed, offsets, indices, ratings, biases, vectors, block_ratings=CHUNK_ROWS,
+               memory_budget=MEMORY_BUDGET):
+    """Refit the bias and vector of every row against the fixed side, a block of rows at a time.
+
+    This is the same ridge solve the backend uses to fold a member in, so the members the
+    model is served to are scored exactly the way the training members were fitted.
+    """
+    for first, last in row_blocks(offsets, block_ratings):
+        lo, hi = offsets[first], offsets[last]
+        biases[first:last], vectors[first:last] = fixed.fold_in_batch(
+            offsets[first:last + 1] - lo, indices[lo:hi], ratings[lo:hi], memory_budget)
+
+
+def evaluate(factor_model, user_biases, user_vectors, users, items, ratings, chunk_rows=CHUNK_ROWS):
+    """MAE and MSE of bounded predictions for (user, item, rating) triples, a chunk at a time."""
+    absolute, squared = 0.0, 0.0
+    for start in range(0, len(ratings), chunk_rows):
+        u, i = np.asarray(users[start:start + chunk_rows]), np.asarray(items[start:start + chunk_rows])
+        predictions = np.einsum('ij,ij->i', user_vectors[u], factor_model.item_factors[i])
+        predictions += factor_model.global_mean + user_biases[u] + factor_model.item_biases[i]
+        np.clip(predictions, factor_model.min_rating, factor_model.max_rating, out=predictions)
+        errors = np.asarray(ratings[start:start + chunk_rows], dtype=np.float64) - predictions
+        absolute += np.abs(errors).sum()
+        squared += np.square(errors).sum()
+    n = max(len(ratings), 1)
+    return {'mae': float(absolute / n), 'mse': float(squared / n)}
+
+
+def train(matrix, n_factors=50, reg=0.05, epochs=10, seed=0, block_ratings=CHUNK_ROWS, memory_budget=MEMORY_BUDGET,
+          on_epoch=None):
+    """Fit a biased matrix factorization by alternating least squares.
+
+    Returns the item side as a FactorModel, with the same reg the backend folds members in
+    with, plus the per-epoch test metrics.
+    """
+    manifest = matrix.manifest
+    rng = np.random.default_rng(seed)
+
+    item_factors = rng.normal(0, 0.1, (matrix.n_items, n_factors))
+    item_biases = np.zeros(matrix.n_items)
+    user_vectors = np.zeros((matrix.n_users, n_factors))
+    user_biases = np.zeros(matrix.n_users)
+
+    # Each side is a FactorModel over the other, sharing the arrays that are refitted in place
+    items = FactorModel(matrix.items.tolist(), item_factors, item_biases, manifest['global_mean'],
+                        min_rating=manifest['min_rating'], max_rating=manifest['max_rating'], reg=reg)
+    users = FactorModel(range(matrix.n_users), user_vectors, user_biases, manifest['global_mean'],
+                        min_rating=manifest['min_rating'], max_rating=manifest['max_rating'], reg=reg)
+
+    history = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        solve_rows(items, matrix.user_offsets, matrix.user_items, matrix.user_ratings, user_biases, user_vectors,
+                   block_ratings, memory_budget)
+        solve_rows(users, matrix.item_offsets, matrix.item_users, matrix.item_ratings, item_biases, item_factors,
+                   block_ratings, memory_budget)
+        metrics = evaluate(items, user_biases, user_vectors, matrix.test_users, matrix.test_items, matrix.test_ratings)
+        history.append(dict(epoch=epoch + 1, seconds=time.perf_counter() - start, **metrics))
+        if on_epoch:
+            on_epoch(history[-1])
+
+    return items, history
+
+
+def save_model(model_dir, factor_model, users, stats):
+    """Export the artifacts, then model_stats.json, whose presence is what makes the model servable."""
+    os.makedirs(model_dir, exist_ok=True)
+    export_factor_model(factor_model, users, model_dir)
+    write_json(os.path.join(model_dir, 'model_stats.json'), stats)
+
+
+def main():
+    from registry import MODELS_ROOT
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', nargs='?', help='Directory of Parquet chunks, a Parquet file or a CSV with '
+                                                  'member, film and rating columns. Omit to reuse --matrix-dir.')
+    parser.add_argument('--matrix-dir', default=MATRIX_DIR)
+    parser.add_argument('--films', type=int, default=5000, help='Keep the most rated films, 0 keeps all of them.')
+    parser.add_argument('--min-user-ratings', type=int, default=5)
+    parser.add_argument('--test-fraction', type=float, default=0.02)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--reg', type=float, default=0.05)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET // 1024 ** 2, help='In megabytes.')
+    parser.add_argument('--name', help='Model directory name. Defaults to one describing the settings.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.source:
+        matrix = build_matrix(args.source, args.matrix_dir, args.films or None, args.min_user_ratings,
+                              args.test_fraction, args.seed, args.chunk_rows)
+    elif RatingsMatrix.exists(args.matrix_dir):
+        matrix = RatingsMatrix.load(args.matrix_dir)
+    else:
+        parser.error(f'No ratings given and no matrix in {args.matrix_dir}.')
+    build_seconds = time.perf_counter() - start
+    print(f'{matrix} ready in {build_seconds:.1f}s, peak memory {peak_memory_mb():.0f} MB.')
+
+    def report(metrics):
+        print(f"Epoch {metrics['epoch']}: test MAE {metrics['mae']:.4f}, MSE {metrics['mse']:.4f} "
+              f"in {metrics['seconds']:.1f}s, peak memory {peak_memory_mb():.0f} MB")
+
+    train_start = time.perf_counter()
+    factor_model, history = train(matrix, args.factors, args.reg, args.epochs, args.seed, args.chunk_rows,
+                                  args.memory_budget * 1024 ** 2, on_epoch=report)
+    train_seconds = time.perf_counter() - train_start
+
+    name = args.name or f'ALS_n{matrix.n_items}_k{args.factors}_l2{args.reg}'
+    stats = {'algo': 'ALS', 'film_count': matrix.n_items, 'user_count': matrix.n_users,
+             'sample_size': len(matrix.user_items) + len(matrix.test_ratings), 'n_factors': args.factors,
+             'l2': args.reg, 'epochs': args.epochs, 'runtime': round(time.perf_counter() - start),
+             'build_seconds': round(build_seconds, 1), 'train_seconds': round(train_seconds, 1),
+             'peak_memory_mb': round(peak_memory_mb()), 'test_mae': history[-1]['mae'] if history else None,
+             'test_mse': history[-1]['mse'] if history else None}
+    model_dir = os.path.join(MODELS_ROOT, name)
+    save_model(model_dir, factor_model, matrix.users.tolist(), stats)
+    print(f'Wrote {model_dir}: {json.dumps(stats)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Throughput and peak memory of threaded_api_request against the asyncio crawler.
+
+Starts benchmarks/fake_letterboxd.py in its own process and runs every mode in a
+fresh interpreter so peak RSS isn't shared between them:
+
+    python benchmarks/bench_bulk_crawl.py --urls 10000 --latency 0.02
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(BENCHMARKS_DIR, '..', 'frontend')
+
+MODES = ('threaded', 'async_collect', 'async_stream')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fake_api(port, films, latency, error_rate, members=1):
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_letterboxd.py'),
+                                '--port', str(port), '--films', str(films), '--members', str(members),
+                                '--latency', str(latency), '--error-rate', str(error_rate)],
+                               stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Fake Letterboxd API did not start.')
+
+
+def run_mode(mode, api_base, paths, concurrency, results):
+    os.environ['LETTERBOXD_API_BASE'] = api_base
+    os.environ['LBXD_CACHE_PATH'] = ''
+    sys.path.insert(0, FRONTEND_DIR)
+    import asyncio
+    import lbxd
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == 'threaded':
+        fetched, _, failed = lbxd.threaded_api_request(paths, max_threads=concurrency, print_every=len(paths) + 1)
+        fetched, failed = len(fetched), len(failed)
+    elif mode == 'async_collect':
+        fetched, _, failed = lbxd.bulk_api_request(paths, concurrency=concurrency, rate=1e6, print_every=0)
+        fetched, failed = len(fetched), len(failed)
+    else:
+        async def consume():
+            counts = {'fetched': 0, 'failed': 0}
+            async for result in lbxd.stream_api_request(paths, concurrency=concurrency, rate=1e6):
+                counts['fetched' if result.status == 200 else 'failed'] += 1
+            return counts['fetched'], counts['failed']
+        fetched, failed = asyncio.run(consume())
+    elapsed = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({'mode': mode, 'urls': len(paths), 'fetched': fetched, 'failed': failed,
+                 'seconds': elapsed, 'urls_per_second': len(paths) / elapsed,
+                 'peak_rss_growth_mb': (peak - baseline) / 1024})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_fake_api(port, args.urls, args.latency, args.error_rate)
+    api_base = f'http://127.0.0.1:{port}/api/v0'
+    paths = [f'film/f{i:05d}' for i in range(args.urls)]
+
+    report = []
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            # lbxd reads credentials.txt from the working directory, the fake API ignores them
+            with open(os.path.join(scratch, 'credentials.txt'), 'w') as f:
+                f.write('benchmark-key\nbenchmark-secret')
+            os.chdir(scratch)
+            context = mp.get_context('spawn')
+            for mode in args.modes:
+                results = context.Queue()
+                process = context.Process(target=run_mode, args=(mode, api_base, paths, args.concurrency, results))
+                process.start()
+                report.append(results.get())
+                process.join()
+    finally:
+        server.terminate()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Load time and memory of the pickled film_data DataFrame against the memory-mapped Arrow catalogue.
+
+Runs against a synthetic catalogue by default, or the real pickle with --film-data:
+
+    python benchmarks/bench_film_catalogue.py --films 100000 --workers 4
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
+sys.path.insert(0, FRONTEND_DIR)
+
+from bench_model_load import memory_mb  # noqa: E402
+from catalogue import FilmCatalogue, build_catalogue  # noqa: E402
+
+GENRES = ['Drama', 'Comedy', 'Thriller', 'Horror', 'Documentary', 'Romance', 'Animation', 'Science Fiction']
+COUNTRIES = ['USA', 'GBR', 'FRA', 'JPN', 'KOR', 'DEU', 'ITA', 'IND']
+
+
+def synthetic_film_data(n_films, seed=0):
+    """Same shape as the crawled film_data pickle, nested dicts and all."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_films):
+        film_id = f'f{i:06d}'
+        rows.append({
+            'id': film_id, 'name': f'Film {i}', 'releaseYear': rng.randint(1920, 2023),
+            'runTime': rng.randint(70, 200), 'popularity': rng.random(), 'rating': rng.uniform(0.5, 5),
+            'tagline': f'Tagline for film {i}', 'description': ' '.join(['Words'] * rng.randint(20, 80)),
+            'poster': {'sizes': [{'width': w, 'height': int(w * 1.5), 'url': f'https://a.ltrbxd.com/{film_id}-{w}.jpg'}
+                                 for w in (70, 150, 230, 500, 1000)]},
+            'links': [{'type': kind, 'id': film_id, 'url': f'https://{kind}.com/{film_id}/'}
+                      for kind in ('letterboxd', 'tmdb', 'imdb')],
+            'directors': [{'id': f'd{rng.randint(0, 20000)}', 'name': f'Director {rng.randint(0, 20000)}'}],
+            'genres': [{'id': g, 'name': g} for g in rng.sample(GENRES, rng.randint(1, 3))],
+            'countries': [{'code': c, 'name': c} for c in rng.sample(COUNTRIES, rng.randint(1, 2))],
+        })
+    return pd.DataFrame(rows)
+
+
+def worker(mode, path, films, barrier, results):
+    baseline = memory_mb()
+    start = time.perf_counter()
+    if mode == 'pickle':
+        film_data = pd.read_pickle(path)
+    else:
+        film_catalogue = FilmCatalogue.load(path)
+    load_seconds = time.perf_counter() - start
+
+    # What a recommendation run does with the catalogue: decorate a dozen picks for display
+    start = time.perf_counter()
+    predictions = pd.DataFrame({'film': films})
+    if mode == 'pickle':
+        picks = predictions.merge(film_data[['id', 'name', 'poster', 'links']], how='left', left_on='film', right_on='id')
+        picks['poster'].apply(lambda x: x['sizes'][-1]['url'])
+    else:
+        picks = film_catalogue.lookup(predictions['film'], ['name', 'poster_url', 'letterboxd_url'])
+    lookup_seconds = time.perf_counter() - start
+    assert len(picks) == len(films)
+
+    barrier.wait()
+    used = memory_mb()
+    results.put({'mode': mode, 'load_seconds': load_seconds, 'lookup_seconds': lookup_seconds,
+                 **{key: used[key] - baseline.get(key, 0) for key in used}})
+    barrier.wait()
+
+
+def run(mode, path, films, workers):
+    context = mp.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, films, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary = {'mode': mode, 'workers': workers, 'file_mb': os.path.getsize(path) / 1024 ** 2}
+    for key in measurements[0]:
+        if key != 'mode':
+            summary[f'mean_{key}'] = float(np.mean([m[key] for m in measurements]))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--film-data', help='Path to film_data.p. A synthetic catalogue is used if omitted.')
+    parser.add_argument('--films', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        pickle_path = args.film_data or os.path.join(scratch, 'film_data.p')
+        film_data = pd.read_pickle(pickle_path) if args.film_data else synthetic_film_data(args.films)
+        if args.film_data is None:
+            film_data.to_pickle(pickle_path)
+        catalogue_path = os.path.join(scratch, 'film_catalogue.arrow')
+        FilmCatalogue(build_catalogue(film_data)).save(catalogue_path)
+        films = film_data['id'].sample(12, random_state=0).tolist()
+        del film_data
+
+        report = [run('pickle', pickle_path, films, args.workers), run('arrow', catalogue_path, films, args.workers)]
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Import time and time to first render of the Streamlit frontend, each in a fresh process.
+
+Serves a synthetic model with the real backend and renders the app with Streamlit's AppTest,
+so every run starts with cold caches like a new frontend container would:
+
+    python benchmarks/bench_frontend_startup.py
+    python benchmarks/bench_frontend_startup.py --frontend /tmp/older/frontend --port 8000
+
+Checkouts from before backend discovery could be configured only look for a backend on
+localhost:8000, hence --port.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(BENCHMARKS_DIR, '..', 'frontend')
+TOOLS = ('Introduction', 'Random movie picker', 'Group watchlist picker', 'Recommendation system',
+         'Film taste compatibility test')
+
+
+def import_times(frontend, root, env):
+    """Milliseconds each top-level import takes, streamlit first as `streamlit run` would."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import streamlit, streamlit_analytics, tools'],
+                            cwd=root, env=dict(os.environ, PYTHONPATH=frontend, **env), capture_output=True,
+                            text=True)
+    times = {}
+    for line in output.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, cumulative, name = line.split('|')
+            if name.startswith(' ') and not name.startswith('  ') and cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1000
+    return {name: times.get(name) for name in ('streamlit', 'streamlit_analytics', 'tools')}
+
+
+def render(frontend, root, tool, env, timeout, results):
+    """Runs in a fresh interpreter, so imports and st.cache_resource start cold."""
+    start = time.perf_counter()
+    os.environ.update(env)
+    os.chdir(root)
+    sys.path.insert(0, frontend)
+    import streamlit_analytics.firestore
+    from streamlit.testing.v1 import AppTest
+
+    # There's no Firestore project to load counts from or save them to, the counting still runs
+    streamlit_analytics.firestore.load = lambda *args, **kwargs: None
+    streamlit_analytics.firestore.save = lambda *args, **kwargs: None
+
+    app = AppTest.from_file(os.path.join(frontend, 'toolboxd_st.py'), default_timeout=timeout)
+    app.run()
+    result = {'tool': tool, 'first_render_seconds': time.perf_counter() - start}
+    # An app that failed before drawing the sidebar has no tool to pick
+    if tool != 'Introduction' and not app.exception:
+        began = time.perf_counter()
+        app.sidebar.selectbox[0].select(tool).run()
+        result['tool_render_seconds'] = time.perf_counter() - began
+    result['total_seconds'] = time.perf_counter() - start
+    result['errors'] = [error.message.splitlines()[0] for error in app.exception]
+    results.put(result)
+
+
+def hanging_server():
+    """A port that accepts connections and never answers, like a backend stuck loading."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(64)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frontend', default=FRONTEND_DIR, help='Frontend directory to measure.')
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--port', type=int, help='Backend port. Defaults to a free one.')
+    parser.add_argument('--repeat', type=int, default=3, help='Cold starts per scenario, the median is reported.')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds a render may take.')
+    parser.add_argument('--pickle-only', action='store_true',
+                        help='Ship only film_data.p, so every cold start builds the Arrow catalogue.')
+    args = parser.parse_args()
+
+    sys.path.insert(0, FRONTEND_DIR)
+    import numpy as np
+    from bench_bulk_crawl import free_port
+    from bench_film_catalogue import synthetic_film_data
+    from catalogue import FilmCatalogue, build_catalogue
+    from suite import build_workspace, film_id, start_backend
+
+    frontend = os.path.abspath(args.frontend)
+    report = {'frontend': frontend, 'config': vars(args), 'scenarios': []}
+    with tempfile.TemporaryDirectory() as root:
+        build_workspace(root, args.items, args.users, args.factors)
+        film_data = synthetic_film_data(args.items)
+        film_data['id'] = [film_id(i) for i in range(args.items)]
+        catalogue_path = os.path.join(root, 'data', 'film_catalogue.arrow')
+        if args.pickle_only:
+            film_data.to_pickle(os.path.join(root, 'data', 'film_data.p'))
+        else:
+            FilmCatalogue(build_catalogue(film_data)).save(catalogue_path)
+
+        port = args.port or free_port()
+        api_base, stuck = f'http://127.0.0.1:{port}', hanging_server()
+        backend = start_backend(root, port)
+        try:
+            # Older checkouts ignore BACKEND_CANDIDATES and always look on localhost:8000
+            found = {'BACKEND_CANDIDATES': api_base}
+            report['import_ms'] = import_times(frontend, root, found)
+
+            scenarios = [(tool, 'backend found', found) for tool in TOOLS]
+            scenarios.append(('Recommendation system', 'first candidate hangs',
+                              {'BACKEND_CANDIDATES': f'http://127.0.0.1:{stuck.getsockname()[1]},{api_base}'}))
+            scenarios.append(('Introduction', 'no backend', {'BACKEND_CANDIDATES': f'http://127.0.0.1:{free_port()}'}))
+
+            context = mp.get_context('spawn')
+            for tool, backend_state, env in scenarios:
+                runs = []
+                for _ in range(args.repeat):
+                    if args.pickle_only and os.path.exists(catalogue_path):
+                        os.remove(catalogue_path)
+                    results = context.Queue()
+                    process = context.Process(target=render, args=(frontend, root, tool, env, args.timeout, results))
+                    process.start()
+                    # Don't wait forever on a process that died before reporting
+                    runs.append(results.get(timeout=2 * args.timeout + 60))
+                    process.join()
+                summary = {'tool': tool, 'backend': backend_state, 'errors': runs[-1]['errors']}
+                for key in ('first_render_seconds', 'tool_render_seconds', 'total_seconds'):
+                    if all(key in run for run in runs):
+                        summary[key] = float(np.median([run[key] for run in runs]))
+                report['scenarios'].append(summary)
+                print(json.dumps(summary), file=sys.stderr)
+        finally:
+            backend.terminate()
+            stuck.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Cold-start time and per-worker memory of the pickle and memory-mapped model paths.
+
+Runs against a synthetic model by default, or a real one with --model-dir:
+
+    python benchmarks/bench_model_load.py --workers 4
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import pickle
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+from artifacts import export_artifacts, has_artifacts, load_artifacts  # noqa: E402
+from engine import FactorModel  # noqa: E402
+
+
+def synthetic_model(n_items, n_users, n_factors, seed=0):
+    rng = np.random.default_rng(seed)
+    items = [f'film{i}' for i in range(n_items)]
+    users = [f'member{i}' for i in range(n_users)]
+    return types.SimpleNamespace(
+        item_id_map={item: i for i, item in enumerate(items)},
+        user_id_map={user: i for i, user in enumerate(users)},
+        item_features=rng.normal(0, 0.1, (n_items, n_factors)),
+        user_features=rng.normal(0, 0.1, (n_users, n_factors)),
+        item_biases=rng.normal(0, 0.1, n_items),
+        user_biases=rng.normal(0, 0.1, n_users),
+        global_mean=3.3, min_rating=0.5, max_rating=5.0, reg=0.005, kernel='linear')
+
+
+def memory_mb():
+    stats = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    stats[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        import resource
+        return {'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    private = stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0)
+    return {'rss_mb': stats.get('Rss', 0), 'private_mb': private}
+
+
+def worker(mode, model_dir, barrier, results):
+    baseline = memory_mb()
+    start = time.perf_counter()
+    if mode == 'pickle':
+        with open(os.path.join(model_dir, 'model.p'), 'rb') as f:
+            factor_model = FactorModel.from_kernel_mf(pickle.load(f))
+    else:
+        factor_model, _ = load_artifacts(model_dir)
+    load_seconds = time.perf_counter() - start
+
+    # Touch every page the way a real request would before measuring
+    user_bias, user_vector = factor_model.fold_in(np.arange(50), np.full(50, 4.0))
+    factor_model.predict(user_bias, user_vector)
+    barrier.wait()
+    used = memory_mb()
+    results.put({'mode': mode, 'load_seconds': load_seconds,
+                 **{key: used[key] - baseline.get(key, 0) for key in used}})
+    barrier.wait()
+
+
+def run(mode, model_dir, workers):
+    context = mp.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, model_dir, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary = {'mode': mode, 'workers': workers}
+    for key in measurements[0]:
+        if key != 'mode':
+            summary[f'mean_{key}'] = float(np.mean([m[key] for m in measurements]))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-dir', help='Directory holding model.p. A synthetic model is used if omitted.')
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        pickle_dir = artifact_dir = args.model_dir or scratch
+        if args.model_dir is None:
+            model = synthetic_model(args.items, args.users, args.factors)
+            with open(os.path.join(scratch, 'model.p'), 'wb') as f:
+                pickle.dump(model, f)
+            export_artifacts(model, scratch)
+        elif not has_artifacts(args.model_dir):
+            with open(os.path.join(args.model_dir, 'model.p'), 'rb') as f:
+                export_artifacts(pickle.load(f), scratch)
+            artifact_dir = scratch
+
+        report = [run('pickle', pickle_dir, args.workers), run('mmap', artifact_dir, args.workers)]
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Time and peak memory of building the ratings matrix and training on it, at crawl scale.
+
+Writes synthetic ratings from a known low-rank model as Parquet chunks, the way
+frontend/crawl_ratings.py does, then builds and trains in separate processes so each
+stage's peak RSS is its own:
+
+    python benchmarks/bench_training.py --ratings 20000000 --epochs 5
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCHMARKS_DIR, '..', 'backend')
+
+
+def synthetic_ratings(out_dir, n_ratings, n_members, n_films, n_factors=10, chunk_rows=1000000, seed=0):
+    """Half-star ratings from biases plus factors plus noise. Films and members are picked with a
+    power law, so a few films carry most ratings like on Letterboxd."""
+    rng = np.random.default_rng(seed)
+    member_vectors = rng.normal(0, 0.4, (n_members, n_factors))
+    film_vectors = rng.normal(0, 0.4, (n_films, n_factors))
+    member_biases, film_biases = rng.normal(0, 0.4, n_members), rng.normal(0, 0.4, n_films)
+    film_weights = 1 / np.arange(1, n_films + 1) ** 0.8
+    member_weights = 1 / np.arange(1, n_members + 1) ** 0.5
+    member_ids = pa.array([f'm{m:07d}' for m in range(n_members)])
+    film_ids = pa.array([f'f{f:06d}' for f in range(n_films)])
+
+    os.makedirs(out_dir, exist_ok=True)
+    for part, start in enumerate(range(0, n_ratings, chunk_rows)):
+        size = min(chunk_rows, n_ratings - start)
+        members = rng.choice(n_members, size, p=member_weights / member_weights.sum()).astype(np.int32)
+        films = rng.choice(n_films, size, p=film_weights / film_weights.sum()).astype(np.int32)
+        ratings = 3.3 + member_biases[members] + film_biases[films] + rng.normal(0, 0.5, size)
+        ratings += np.einsum('ij,ij->i', member_vectors[members], film_vectors[films])
+        ratings = np.clip(np.round(ratings * 2) / 2, 0.5, 5.0).astype(np.float32)
+        table = pa.table({'member': pa.DictionaryArray.from_arrays(members, member_ids),
+                          'film': pa.DictionaryArray.from_arrays(films, film_ids), 'rating': ratings})
+        pq.write_table(table, os.path.join(out_dir, f'part-{part:05d}.parquet'))
+
+
+def stage(name, settings, results):
+    sys.path.insert(0, BACKEND_DIR)
+    from ratings_matrix import RatingsMatrix, build_matrix
+    from training import train
+
+    start = time.perf_counter()
+    if name == 'build':
+        matrix = build_matrix(settings['source'], settings['matrix_dir'], settings['films'], settings['min_user_ratings'],
+                              chunk_rows=settings['chunk_rows'])
+        extra = {key: matrix.manifest[key] for key in ('n_users', 'n_items', 'n_train', 'n_test', 'duplicates_dropped')}
+    else:
+        matrix = RatingsMatrix.load(settings['matrix_dir'])
+        _, history = train(matrix, settings['factors'], settings['reg'], settings['epochs'],
+                           block_ratings=settings['chunk_rows'])
+        extra = {'epochs': history, 'test_mse': history[-1]['mse'], 'baseline_mse': float(np.var(matrix.test_ratings))}
+    seconds = time.perf_counter() - start
+    results.put(dict(stage=name, seconds=seconds, ratings_per_second=len(matrix.user_items) / seconds,
+                     peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, **extra))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ratings', type=int, default=20000000)
+    parser.add_argument('--members', type=int, default=200000)
+    parser.add_argument('--films', type=int, default=20000)
+    parser.add_argument('--keep-films', type=int, default=5000)
+    parser.add_argument('--min-user-ratings', type=int, default=5)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--reg', type=float, default=0.05)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--chunk-rows', type=int, default=2000000)
+    args = parser.parse_args()
+
+    report = {'config': vars(args), 'stages': []}
+    with tempfile.TemporaryDirectory() as root:
+        source = os.path.join(root, 'ratings')
+        start = time.perf_counter()
+        synthetic_ratings(source, args.ratings, args.members, args.films)
+        report['generate_seconds'] = time.perf_counter() - start
+        report['parquet_mb'] = sum(os.path.getsize(os.path.join(source, f)) for f in os.listdir(source)) / 1024 ** 2
+
+        settings = {'source': source, 'matrix_dir': os.path.join(root, 'matrix'), 'films': args.keep_films,
+                    'min_user_ratings': args.min_user_ratings, 'chunk_rows': args.chunk_rows,
+                    'factors': args.factors, 'reg': args.reg, 'epochs': args.epochs}
+        context = mp.get_context('spawn')
+        for name in ('build', 'train'):
+            results = context.Queue()
+            process = context.Process(target=stage, args=(name, settings, results))
+            process.start()
+            report['stages'].append(results.get())
+            process.join()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Recommendation throughput as backend worker processes are added, and behaviour past the queue limit.
+
+Serves a synthetic model with uvicorn at each worker count, drives it with concurrent clients
+while probing GET / to see whether the event loop stays responsive, and reports the
+proportional memory (PSS) of all workers, which counts the memory-mapped model once rather than per worker:
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --concurrency 16
+
+BLAS is pinned to one thread per process so the scaling comes from workers and compute threads.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from bench_bulk_crawl import free_port
+from suite import build_workspace, film_id, start_backend, summarise
+
+SINGLE_THREADED_BLAS = {'OMP_NUM_THREADS': '1', 'OPENBLAS_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'}
+
+
+def process_tree(pid):
+    children = []
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        for child in f.read().split():
+            children += process_tree(int(child))
+    return [pid] + children
+
+
+def tree_memory_mb(pid):
+    """RSS counts shared model pages once per worker, PSS splits them between the workers mapping them."""
+    memory = {'rss_mb': 0.0, 'pss_mb': 0.0}
+    for process in process_tree(pid):
+        with open(f'/proc/{process}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(('Rss:', 'Pss:')):
+                    memory[line.split(':')[0].lower() + '_mb'] += int(line.split()[1]) / 1024
+    return memory
+
+
+def recommendation_requests(api_base, n_items, n_requests, n_ratings, seed=0):
+    rng = np.random.default_rng(seed)
+    bodies = []
+    for _ in range(n_requests):
+        indices = rng.choice(n_items, n_ratings, replace=False)
+        bodies.append({'user': 'bench', 'items': [film_id(i) for i in indices],
+                       'ratings': rng.choice(np.arange(1, 11) / 2, n_ratings).tolist(), 'k': 12, 'relative': True})
+    return [(api_base + '/v1/recommendations', body) for body in bodies]
+
+
+def drive(name, api_base, to_send, concurrency, **extra):
+    """Send every request, counting 503s instead of failing, while a probe times GET / alongside."""
+    local = threading.local()
+    statuses, probes = [], []
+    done = threading.Event()
+
+    def send(request):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        url, body = request
+        start = time.perf_counter()
+        response = session.post(url, json=body)
+        if response.status_code != 503:
+            response.raise_for_status()
+        statuses.append(response.status_code)
+        return time.perf_counter() - start
+
+    def probe():
+        with requests.Session() as session:
+            while not done.is_set():
+                start = time.perf_counter()
+                session.get(api_base + '/').raise_for_status()
+                probes.append(time.perf_counter() - start)
+                time.sleep(0.05)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, to_send))
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+
+    served = [latency for latency, status in zip(latencies, statuses) if status == 200]
+    probes = np.asarray(probes) * 1000
+    return summarise(name, served, elapsed, count=len(served), concurrency=concurrency,
+                     rejected=statuses.count(503), probe_p50_ms=float(np.percentile(probes, 50)),
+                     probe_p99_ms=float(np.percentile(probes, 99)), **extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--ratings', type=int, default=300, help='Ratings per simulated user.')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--overload-queue', type=int, default=2,
+                        help='COMPUTE_QUEUE for the single worker, single thread overload run.')
+    args = parser.parse_args()
+
+    report = {'cpus': os.cpu_count(), 'config': vars(args), 'scenarios': []}
+    with tempfile.TemporaryDirectory() as root:
+        build_workspace(root, args.items, args.users, args.factors)
+
+        # The scaling runs queue every client so nothing is rejected, the overload run queues almost none
+        runs = [(f'workers_{workers}', workers, {'COMPUTE_QUEUE': str(args.concurrency)}) for workers in args.workers]
+        runs.append(('overload', 1, {'COMPUTE_THREADS': '1', 'COMPUTE_QUEUE': str(args.overload_queue)}))
+        for name, workers, env in runs:
+            port = free_port()
+            backend = start_backend(root, port, workers, **SINGLE_THREADED_BLAS, **env)
+            try:
+                api_base = f'http://127.0.0.1:{port}'
+                to_send = recommendation_requests(api_base, args.items, args.requests, args.ratings)
+                # Warm every worker's page cache and code paths before timing
+                drive('warmup', api_base, to_send[:workers * 8], args.concurrency)
+                result = drive(name, api_base, to_send, args.concurrency, workers=workers, **env)
+                result.update(tree_memory_mb(backend.pid))
+                report['scenarios'].append(result)
+            finally:
+                backend.terminate()
+                backend.wait()
+
+    print(json.dumps(report, indent=2))
+    baseline = report['scenarios'][0]['throughput_per_second']
+    for result in report['scenarios']:
+        print(f"{result['scenario']:>12}: {result['throughput_per_second']:7.1f}/s ({result['throughput_per_second'] / baseline:4.2f}x), "
+              f"p50 {result.get('p50_ms', float('nan')):7.1f}ms, probe p99 {result['probe_p99_ms']:6.1f}ms, "
+              f"rejected {result['rejected']:4d}, PSS {result['pss_mb']:6.1f}MB, RSS {result['rss_mb']:6.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
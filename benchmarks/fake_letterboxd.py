@@ -0,0 +1,154 @@
+"""A local stand-in for api.letterboxd.com with synthetic members, films and injected latency.
+
+Point the frontend at it with LETTERBOXD_API_BASE=http://127.0.0.1:<port>/api/v0,
+LETTERBOXD_WEB_BASE=http://127.0.0.1:<port> and any credentials.txt. Signatures are not checked,
+and member pages resolve usernames to themselves (m0000, m0001, ...).
+
+    python benchmarks/fake_letterboxd.py --port 8765 --latency 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeLetterboxd:
+
+    def __init__(self, n_films=5000, n_members=100, ratings_per_member=500, watchlist_size=200,
+                 latency=0.0, error_rate=0.0, seed=0):
+        rng = random.Random(seed)
+        self.films = [f'f{i:05d}' for i in range(n_films)]
+        self.film_set = set(self.films)
+        self.ratings = {}
+        self.watchlists = {}
+        for m in range(n_members):
+            member = f'm{m:04d}'
+            rated = rng.sample(self.films, min(ratings_per_member, n_films))
+            self.ratings[member] = [(film, rng.choice([0.5 * x for x in range(1, 11)])) for film in rated]
+            self.watchlists[member] = rng.sample(self.films, min(watchlist_size, n_films))
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def film(self, film_id):
+        number = int(film_id[1:])
+        return {'id': film_id, 'name': f'Film {number}', 'releaseYear': 1950 + number % 70,
+                'links': [{'type': 'letterboxd', 'url': f'https://letterboxd.com/film/{film_id}/'}],
+                'directors': [{'name': f'Director {number % 300}'}], 'poster': {'sizes': []}}
+
+    def page(self, entries, query):
+        start = int(query.get('cursor', ['start=0'])[0].split('=')[-1])
+        per_page = int(query.get('perPage', ['20'])[0])
+        body = {'items': entries[start:start + per_page]}
+        if start + per_page < len(entries):
+            body['next'] = f'start={start + per_page}'
+        return body
+
+    def respond(self, path, query):
+        parts = [part for part in path.split('/') if part][2:]  # drop api/v0
+        if parts[:1] == ['films']:
+            member = query.get('member', [None])[0]
+            if member not in self.ratings:
+                return 404, None
+            # Ratings are stored newest first, which is what DateLatestFirst returns
+            ratings = self.ratings[member]
+            if query.get('sort', [None])[0] == 'MemberRatingHighToLow':
+                ratings = sorted(ratings, key=lambda x: -x[1])
+            entries = [dict(self.film(film), relationships=[{'member': {'id': member},
+                                                             'relationship': {'rating': rating, 'watched': True}}])
+                       for film, rating in ratings]
+            return 200, self.page(entries, query)
+        if parts[:1] == ['member'] and len(parts) == 3 and parts[2] == 'watchlist':
+            if parts[1] not in self.watchlists:
+                return 404, None
+            return 200, self.page([self.film(film) for film in self.watchlists[parts[1]]], query)
+        if parts[:1] == ['film'] and len(parts) == 2:
+            if parts[1] not in self.film_set:
+                return 404, None
+            return 200, self.film(parts[1])
+        return 404, None
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out as separate writes, which stalls on delayed ACKs with Nagle on
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlparse(self.path)
+                if fake.error_rate and fake.rng.random() < fake.error_rate:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status, body = fake.respond(url.path, parse_qs(url.query))
+                payload = json.dumps(body).encode() if body is not None else b''
+                etag = '"' + hashlib.md5(payload).hexdigest() + '"'
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if status == 200:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_HEAD(self):
+                # Member pages only, which is all lbxd.get_id_from_username needs
+                member = urlparse(self.path).path.strip('/')
+                self.send_response(200 if member in fake.ratings else 404)
+                if member in fake.ratings:
+                    self.send_header('X-Letterboxd-Identifier', member)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def serve(self, port=0):
+        """Start serving on a background thread and return the API base URL."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}/api/v0'
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--films', type=int, default=5000)
+    parser.add_argument('--members', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503.')
+    args = parser.parse_args()
+
+    fake = FakeLetterboxd(n_films=args.films, n_members=args.members, latency=args.latency,
+                          error_rate=args.error_rate)
+    print(f'Serving a fake Letterboxd API at {fake.serve(args.port)}')
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
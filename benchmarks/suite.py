@@ -0,0 +1,303 @@
+"""Offline latency, throughput and memory benchmarks for the backend and lbxd data paths.
+
+Builds a synthetic model, film index and fake Letterboxd API in a scratch directory, serves
+the real backend from it with uvicorn and drives every scenario with concurrent clients.
+Results are written as JSON so runs from different commits can be compared:
+
+    python benchmarks/suite.py --items 20000 --concurrency 8
+    python benchmarks/suite.py --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCHMARKS_DIR, '..', 'backend')
+FRONTEND_DIR = os.path.join(BENCHMARKS_DIR, '..', 'frontend')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_bulk_crawl import free_port, start_fake_api  # noqa: E402
+from bench_film_catalogue import synthetic_film_data  # noqa: E402
+from bench_model_load import synthetic_model  # noqa: E402
+
+from artifacts import export_artifacts  # noqa: E402
+from film_index import FilmIndex  # noqa: E402
+from schemas import unpack_ratings  # noqa: E402
+
+MODEL_NAME = 'synthetic'
+# Members per compatibility request, the size of a big group
+GROUP_SIZE = 50
+FILTERS = {'year_range': [1970, 2010], 'runtime_range': [80, 150], 'include_genres': ['Drama', 'Comedy']}
+
+
+def check_packed_format():
+    """The frontend packs requests with its own copy of pack_ratings. Returns it once the backend reads it back."""
+    sys.path.append(FRONTEND_DIR)
+    from vocabulary import pack_ratings
+
+    indices, ratings, exclude = np.array([3, 0, 7]), np.array([4.5, 0.5, 3.0]), np.array([1, 2])
+    options = {'user': 'bench', 'vocabulary': 'v', 'relative': True, 'filters': FILTERS}
+    try:
+        unpacked = unpack_ratings(pack_ratings(indices, ratings, exclude, 12, options))
+    except ValueError:
+        unpacked = None
+    if unpacked is None or not (np.array_equal(unpacked[0], indices) and np.array_equal(unpacked[1], ratings)
+                                and np.array_equal(unpacked[2], exclude) and unpacked[3] == 12
+                                and unpacked[4].model_dump(mode='json', exclude_none=True) == options):
+        raise SystemExit('frontend/vocabulary.py packs requests in a format backend/schemas.py no longer reads.')
+    return pack_ratings
+
+
+def film_id(i):
+    # Same IDs as benchmarks/fake_letterboxd.py, so crawled films are known to the model
+    return f'f{i:05d}'
+
+
+def build_workspace(root, n_items, n_users, n_factors):
+    model = synthetic_model(n_items, n_users, n_factors)
+    model.item_id_map = {film_id(i): i for i in range(n_items)}
+    model_dir = os.path.join(root, 'models', 'gridsearch', MODEL_NAME)
+    os.makedirs(model_dir)
+    export_artifacts(model, model_dir)
+    with open(os.path.join(model_dir, 'model_stats.json'), 'w') as f:
+        json.dump({'algo': 'synthetic', 'film_count': n_items, 'n_factors': n_factors}, f)
+
+    film_data = synthetic_film_data(n_items)
+    film_data['id'] = [film_id(i) for i in range(n_items)]
+    FilmIndex.from_film_data(film_data).save(os.path.join(root, 'data', 'film_index.npz'))
+
+    # lbxd reads credentials.txt from the working directory, the fake API ignores them
+    with open(os.path.join(root, 'credentials.txt'), 'w') as f:
+        f.write('benchmark-key\nbenchmark-secret')
+
+
+def start_backend(root, port, workers=1, **env):
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, MODEL_NAME=MODEL_NAME, MODEL_WATCH_INTERVAL='0',
+               WEB_CONCURRENCY=str(workers), **env)
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+                                '--workers', str(workers), '--log-level', 'warning'], cwd=root, env=env,
+                               stdout=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=1).raise_for_status()
+            return process
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Backend did not start.')
+
+
+def process_memory_mb(pid):
+    memory = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                memory[line.split(':')[0]] = int(line.split()[1]) / 1024
+    return {'rss_mb': memory.get('VmRSS'), 'peak_rss_mb': memory.get('VmHWM')}
+
+
+def summarise(name, latencies, seconds, count=None, **extra):
+    """Percentiles of per-request latencies, or only throughput when requests overlap too much to time."""
+    summary = {'scenario': name, 'requests': len(latencies) if count is None else count, 'seconds': seconds}
+    summary['throughput_per_second'] = summary['requests'] / seconds
+    if len(latencies):
+        latencies = np.asarray(latencies) * 1000
+        summary.update(p50_ms=float(np.percentile(latencies, 50)), p95_ms=float(np.percentile(latencies, 95)),
+                       p99_ms=float(np.percentile(latencies, 99)), mean_ms=float(latencies.mean()),
+                       max_ms=float(latencies.max()))
+    return dict(summary, **extra)
+
+
+def run_clients(name, requests_to_send, concurrency, **extra):
+    """Send prepared (method, url, kwargs) requests from concurrency threads, one session each."""
+    local = threading.local()
+
+    def send(request):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        method, url, kwargs = request
+        start = time.perf_counter()
+        session.request(method, url, **kwargs).raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, requests_to_send))
+    return summarise(name, latencies, time.perf_counter() - start, concurrency=concurrency, **extra)
+
+
+def backend_scenarios(api_base, n_items, n_requests, n_ratings, concurrency, seed=0):
+    pack_ratings = check_packed_format()
+    rng = np.random.default_rng(seed)
+    vocabulary = requests.get(api_base + '/v1/items').json()
+
+    def user(u):
+        indices = rng.choice(n_items, n_ratings, replace=False)
+        ratings = rng.choice(np.arange(1, 11) / 2, n_ratings)
+        return indices, ratings
+
+    users = [user(u) for u in range(n_requests)]
+
+    def json_request(indices, ratings, **options):
+        body = {'user': 'bench', 'items': [film_id(i) for i in indices], 'ratings': ratings.tolist(), 'k': 12,
+                'relative': True, **options}
+        return ('POST', api_base + '/v1/recommendations', {'json': body})
+
+    def packed_request(indices, ratings):
+        body = pack_ratings(indices, ratings, k=12, options={'user': 'bench', 'relative': True,
+                                                             'vocabulary': vocabulary['version']})
+        return ('POST', api_base + '/v1/recommendations/packed', {'data': body})
+
+    watchlists = [[film_id(i) for i in rng.choice(n_items, 200, replace=False)] for _ in range(n_requests)]
+
+    def compatibility_request(group):
+        members = [{'user': f'm{u}', 'indices': indices.tolist(), 'ratings': ratings.tolist()}
+                   for u, (indices, ratings) in enumerate(group)]
+        return ('POST', api_base + '/v1/compatibility', {'json': {'users': members, 'vocabulary': vocabulary['version']}})
+
+    groups = [users[first:first + GROUP_SIZE] for first in range(0, n_requests - GROUP_SIZE + 1, GROUP_SIZE)]
+    return [
+        run_clients('recommend_json', [json_request(*u) for u in users], concurrency, ratings=n_ratings),
+        run_clients('recommend_packed', [packed_request(*u) for u in users], concurrency, ratings=n_ratings),
+        # Same rating sets again with filters, which the result cache should serve without a fold-in
+        run_clients('recommend_filtered_repeat', [json_request(*u, filters=FILTERS) for u in users], concurrency,
+                    ratings=n_ratings),
+        run_clients('filter_items', [('POST', api_base + '/filter_items',
+                                      {'json': {'items': w, 'filters': FILTERS}}) for w in watchlists],
+                    concurrency, items=200),
+        run_clients('compatibility_group', [compatibility_request(group) for group in groups], concurrency,
+                    group_size=GROUP_SIZE, ratings=n_ratings),
+    ]
+
+
+def client_scenario(name, root, api_base, web_base, settings, results):
+    """Runs in a fresh interpreter so each scenario's peak RSS is its own."""
+    os.environ.update(LETTERBOXD_API_BASE=api_base, LETTERBOXD_WEB_BASE=web_base, LBXD_CACHE_PATH='',
+                      LBXD_SYNC_PATH='')
+    os.chdir(root)
+    sys.path.insert(0, FRONTEND_DIR)
+    import groups
+    import lbxd
+
+    members = [f'm{m:04d}' for m in range(settings['members'])]
+    latencies, extra = [], {}
+    start = time.perf_counter()
+    if name == 'pagination':
+        for member in members:
+            began = time.perf_counter()
+            lbxd.get_user_ratings(lbxd.get_id_from_username(member))
+            latencies.append(time.perf_counter() - began)
+    elif name == 'group_overlap':
+        group_size = settings['group_size']
+        for first in range(0, len(members) - group_size + 1, group_size):
+            began = time.perf_counter()
+            group = groups.GroupWatchlists.fetch(members[first:first + group_size])
+            group.overlap(2)
+            latencies.append(time.perf_counter() - began)
+        extra['group_size'] = group_size
+    elif name == 'bulk_crawl':
+        paths = [f'film/{film_id(i)}' for i in range(settings['crawl_urls'])]
+        fetched, _, failed = lbxd.bulk_api_request(paths, concurrency=settings['concurrency'] * 8, rate=1e6,
+                                                   print_every=0)
+        extra.update(count=len(paths), fetched=len(fetched), failed=len(failed))
+    elapsed = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put(summarise(name, latencies, elapsed, peak_rss_mb=peak / 1024, **extra))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {entry['scenario']: entry for entry in json.load(f)['scenarios']}
+    for entry in report['scenarios']:
+        before = baseline.get(entry['scenario'])
+        if before is None:
+            continue
+        line = (f"{entry['scenario']:>28}: throughput {entry['throughput_per_second']:8.1f}/s "
+                f"({entry['throughput_per_second'] / before['throughput_per_second']:5.2f}x)")
+        if 'p50_ms' in entry and 'p50_ms' in before:
+            line += f", p50 {entry['p50_ms']:8.2f}ms ({entry['p50_ms'] / before['p50_ms']:5.2f}x)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--ratings', type=int, default=300, help='Ratings per simulated user.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--members', type=int, default=40, help='Members served by the fake API.')
+    parser.add_argument('--group-size', type=int, default=20)
+    parser.add_argument('--crawl-urls', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds the fake API adds to every response.')
+    parser.add_argument('--output', help='Where to write the JSON report. Defaults to benchmarks/results/.')
+    parser.add_argument('--compare', help='An earlier JSON report to print ratios against.')
+    args = parser.parse_args()
+
+    report = {'commit': git_commit(), 'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'python': platform.python_version(), 'numpy': np.__version__, 'config': vars(args), 'scenarios': []}
+
+    with tempfile.TemporaryDirectory() as root:
+        build_workspace(root, args.items, args.users, args.factors)
+
+        backend_port, fake_port = free_port(), free_port()
+        backend = start_backend(root, backend_port)
+        try:
+            report['scenarios'] += backend_scenarios(f'http://127.0.0.1:{backend_port}', args.items, args.requests,
+                                                     args.ratings, args.concurrency)
+            report['backend_memory'] = process_memory_mb(backend.pid)
+        finally:
+            backend.terminate()
+
+        fake_api = start_fake_api(fake_port, args.items, args.latency, 0.0, members=args.members)
+        try:
+            settings = {'members': args.members, 'group_size': args.group_size, 'crawl_urls': args.crawl_urls,
+                        'concurrency': args.concurrency}
+            context = mp.get_context('spawn')
+            for name in ('pagination', 'group_overlap', 'bulk_crawl'):
+                results = context.Queue()
+                process = context.Process(target=client_scenario, args=(
+                    name, root, f'http://127.0.0.1:{fake_port}/api/v0', f'http://127.0.0.1:{fake_port}',
+                    settings, results))
+                process.start()
+                report['scenarios'].append(results.get())
+                process.join()
+        finally:
+            fake_api.terminate()
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{report["created"][:10]}-{report["commit"] or "local"}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['scenarios'], indent=2))
+    print(f'Wrote {output}.')
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.environ.get('LBXD_CACHE_PATH', 'cache/letterboxd_api.sqlite')
+CACHE_MAX_BYTES = int(os.environ.get('LBXD_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# First matching path prefix wins. Film metadata barely changes, member data does.
+TTL_RULES = [
+    ('film/', 7 * 24 * 3600),
+    ('films/', 3600),
+    ('member/', 3600),
+]
+DEFAULT_TTL = 24 * 3600
+
+
+def ttl_for(path):
+    for prefix, ttl in TTL_RULES:
+        if path.startswith(prefix):
+            return ttl
+    return DEFAULT_TTL
+
+
+class CachedResponse:
+    """Enough of requests.Response for lbxd's callers, rebuilt from a cache row."""
+
+    def __init__(self, status_code, headers, content, stored_at, from_cache=True):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.stored_at = stored_at
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def etag(self):
+        return self.headers.get('ETag') or self.headers.get('etag')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ApiCache:
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, ttl_for=ttl_for):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_for = ttl_for
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0}
+        self.stored_since_eviction = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                              path TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB,
+                              stored_at REAL, accessed_at REAL, size INTEGER)""")
+            db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+
+    def connection(self):
+        # sqlite connections can't be shared across threads, and threaded_api_request uses many
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def lookup(self, path):
+        """Cached response for path and whether it's still within its TTL."""
+        row = self.connection().execute('SELECT status, headers, body, stored_at FROM responses WHERE path = ?',
+                                        (path,)).fetchone()
+        if row is None:
+            return None, False
+        status, headers, body, stored_at = row
+        response = CachedResponse(status, json.loads(headers), body, stored_at)
+        return response, time.time() - stored_at < self.ttl_for(path)
+
+    def touch(self, path, refresh=False):
+        now = time.time()
+        with self.connection() as db:
+            if refresh:
+                db.execute('UPDATE responses SET accessed_at = ?, stored_at = ? WHERE path = ?', (now, now, path))
+            else:
+                db.execute('UPDATE responses SET accessed_at = ? WHERE path = ?', (now, path))
+
+    def store(self, path, response):
+        headers = {key: value for key, value in response.headers.items() if key.lower() in ('etag', 'content-type')}
+        now = time.time()
+        with self.connection() as db:
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (path, response.status_code, json.dumps(headers), response.content, now, now,
+                        len(response.content)))
+        self.count('stores')
+        self.stored_since_eviction += 1
+        if self.stored_since_eviction >= 100:
+            self.evict()
+
+    def evict(self):
+        self.stored_since_eviction = 0
+        with self.connection() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # Drop least recently used entries until we're back under 90% of the bound
+            excess = total - int(self.max_bytes * 0.9)
+            rows = db.execute('SELECT path, size FROM responses ORDER BY accessed_at').fetchall()
+            doomed = []
+            for path, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((path,))
+                excess -= size
+            db.executemany('DELETE FROM responses WHERE path = ?', doomed)
+        with self._lock:
+            self.stats['evictions'] += len(doomed)
+
+    def fetch(self, path, request, revalidate=False):
+        """Serve path from the cache, calling request(headers) on a miss or to revalidate a stale entry.
+
+        revalidate treats a fresh entry as stale, which costs a conditional request instead of a full one.
+        """
+        cached, fresh = self.lookup(path)
+        if fresh and not revalidate:
+            self.count('hits')
+            self.touch(path)
+            return cached
+
+        headers = {'If-None-Match': cached.etag} if cached is not None and cached.etag else {}
+        response = request(headers)
+        if response.status_code == 304 and cached is not None:
+            self.count('revalidated')
+            self.touch(path, refresh=True)
+            return cached
+
+        self.count('misses')
+        if response.status_code == 200:
+            self.store(path, response)
+        return response
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['revalidated'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['revalidated']) / lookups if lookups else 0.0
+        entries, size = self.connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        stats['entries'], stats['bytes'] = entries, size
+        return stats
+
+    def clear(self):
+        with self.connection() as db:
+            db.execute('DELETE FROM responses')
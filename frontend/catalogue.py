@@ -0,0 +1,162 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+FILM_DATA_PATH = 'data/film_data.p'
+CATALOGUE_PATH = 'data/film_catalogue.arrow'
+
+
+def _poster_url(poster):
+    sizes = poster.get('sizes') if isinstance(poster, dict) else None
+    return sizes[-1]['url'] if sizes else ''
+
+
+def _link_urls(links):
+    return [x['url'] for x in links if x.get('url')] if isinstance(links, list) else []
+
+
+def _name_list(entries, key='name'):
+    return [x[key] for x in entries if x.get(key)] if isinstance(entries, list) else []
+
+
+def _names(entries, key='name'):
+    return ', '.join(_name_list(entries, key))
+
+
+def _dictionary_lists(lists):
+    """List column whose values are dictionary-encoded, so each distinct string is stored once."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    np.cumsum([len(x) for x in lists], out=offsets[1:])
+    values = pa.array([x for names in lists for x in names], type=pa.string()).dictionary_encode()
+    return pa.ListArray.from_arrays(pa.array(offsets), values)
+
+
+def _text(column):
+    return pa.array([x if isinstance(x, str) else None for x in column], type=pa.string())
+
+
+def build_catalogue(film_data):
+    """Flatten the pickled film_data DataFrame into a typed Arrow table, one row per film."""
+    def numeric(column):
+        return pa.array(pd.to_numeric(film_data[column], errors='coerce').to_numpy(dtype=np.float32),
+                        from_pandas=True)
+
+    links = [_link_urls(x) for x in film_data['links']]
+    return pa.table({
+        'id': film_data['id'].astype(str).to_numpy(),
+        'name': _text(film_data['name']),
+        'releaseYear': numeric('releaseYear'),
+        'runTime': numeric('runTime'),
+        'popularity': numeric('popularity'),
+        'rating': numeric('rating'),
+        'tagline': _text(film_data['tagline']),
+        'description': _text(film_data['description']),
+        'poster_url': pa.array([_poster_url(x) for x in film_data['poster']], type=pa.string()),
+        'letterboxd_url': pa.array([x[0] if x else None for x in links], type=pa.string()),
+        'links': pa.array(links, type=pa.list_(pa.string())),
+        # Directors, genres and countries repeat a lot, so store each distinct string once
+        'directors': pa.array([_names(x) for x in film_data['directors']]).dictionary_encode(),
+        'countries': pa.array([_names(x) for x in film_data['countries']]).dictionary_encode(),
+        # Lists rather than joined strings, so the filters match names without parsing them
+        'genres': _dictionary_lists([_name_list(x) for x in film_data['genres']]),
+        # ISO codes, which is what the country filter takes
+        'country_codes': _dictionary_lists([_name_list(x, 'code') for x in film_data['countries']]),
+    })
+
+
+class FilmCatalogue:
+    """Read-only film metadata backed by a memory-mapped Arrow file.
+
+    Nothing is turned into Python objects until a caller asks for specific films, so
+    every Streamlit process shares the same page-cache copy of the catalogue.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = table.column('id')
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @classmethod
+    def load(cls, path=CATALOGUE_PATH):
+        with pa.memory_map(path) as source:
+            return cls(pa.ipc.open_file(source).read_all())
+
+    def save(self, path=CATALOGUE_PATH):
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # Each process writes its own temporary file, so frontends building the catalogue at once don't mix writes
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.arrow', delete=False) as f:
+            # Left uncompressed so loading is a memory map rather than a decode
+            with pa.ipc.new_file(f, self.table.schema) as writer:
+                writer.write_table(self.table)
+        os.replace(f.name, path)
+
+    def locate(self, films):
+        """Catalogue row for each film ID, -1 where the film isn't in the catalogue."""
+        rows = pc.index_in(pa.array([str(x) for x in films], type=pa.string()), value_set=self.ids)
+        return rows.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.intp)
+
+    def take(self, rows, columns):
+        """DataFrame of the requested columns for catalogue rows, with nulls where a row is -1."""
+        rows = np.asarray(rows)
+        return self.table.select(columns).take(pa.array(rows, type=pa.int64(), mask=rows < 0)).to_pandas()
+
+    def _has_any(self, column, names):
+        column = self.table.column(column).combine_chunks()
+        values = column.flatten()
+        # Match against each distinct name once, then spread the result over every film's entries
+        matched = pc.is_in(values.dictionary, value_set=pa.array(names, type=pa.string()))
+        hits = matched.to_numpy(zero_copy_only=False)[values.indices.to_numpy(zero_copy_only=False)]
+        parents = pc.list_parent_indices(column).to_numpy()
+        mask = np.zeros(len(self), dtype=bool)
+        mask[parents[hits]] = True
+        return mask
+
+    def mask(self, rows, year_range=None, runtime_range=None, popularity_range=None, rating_range=None,
+             country_specification=None, include_genres=None):
+        """Which catalogue rows pass the advanced filters, with the backend FilmIndex's semantics.
+
+        Bounds are inclusive, films with missing metadata never pass a range filter and rows
+        of -1 never pass at all.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        mask = np.ones(len(self), dtype=bool)
+        for column, bounds in (('releaseYear', year_range), ('runTime', runtime_range),
+                               ('popularity', popularity_range), ('rating', rating_range)):
+            if bounds:
+                values = self.table.column(column).to_numpy()
+                mask &= (values >= bounds[0]) & (values <= bounds[1])
+        if country_specification:
+            mask &= self._has_any('country_codes', [country_specification])
+        if include_genres:
+            mask &= self._has_any('genres', include_genres)
+        return (rows >= 0) & mask[rows]
+
+    def lookup(self, films, columns):
+        """DataFrame of the requested columns for films, in the same order, with nulls for unknown films."""
+        films = list(films)
+        frame = self.take(self.locate(films), columns)
+        frame.insert(0, 'id', films)
+        return frame
+
+
+def load_catalogue(path=CATALOGUE_PATH, film_data_path=FILM_DATA_PATH):
+    # Deployments that only ship the pickle build the catalogue once on first start
+    if not os.path.exists(path):
+        FilmCatalogue(build_catalogue(pd.read_pickle(film_data_path))).save(path)
+    return FilmCatalogue.load(path)
+
+
+if __name__ == '__main__':
+    film_data_path = sys.argv[1] if len(sys.argv) > 1 else FILM_DATA_PATH
+    catalogue_path = sys.argv[2] if len(sys.argv) > 2 else CATALOGUE_PATH
+    catalogue = FilmCatalogue(build_catalogue(pd.read_pickle(film_data_path)))
+    catalogue.save(catalogue_path)
+    print(f'Wrote {len(catalogue)} films to {catalogue_path}.')
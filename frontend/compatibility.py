@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+import lbxd
+import user_sync
+from vocabulary import BACKEND_TIMEOUT, VocabularyChanged
+
+MAX_FETCH_WORKERS = 16
+# Must match backend/schemas.py
+MAX_GROUP_USERS = 100
+MIN_OVERLAP = 5
+
+MEASURES = ('overlap', 'jaccard', 'correlation', 'rms_difference', 'latent_cosine')
+
+
+def fetch_ratings(usernames, max_workers=MAX_FETCH_WORKERS):
+    """Each member's ratings, or None where they couldn't be fetched. Synced members cost one request."""
+    def fetch_one(username):
+        try:
+            return user_sync.sync_user_ratings(lbxd.get_id_from_username(username))
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(usernames)))) as executor:
+        return dict(zip(usernames, executor.map(fetch_one, usernames)))
+
+
+class GroupCompatibility:
+    """Pairwise taste compatibility of a group of members, one (members, members) array per measure.
+
+    latent_cosine compares the members' tastes as the model sees them, so it's defined even
+    for pairs who've rated nothing in common. correlation and rms_difference only cover films
+    both members rated and are NaN for pairs sharing fewer than min_overlap of them.
+    """
+
+    def __init__(self, members, rated, measures):
+        self.members = members
+        self.rated = rated
+        self.measures = measures
+
+    @classmethod
+    def request(cls, api_base, vocabulary, ratings, min_overlap=MIN_OVERLAP):
+        users = []
+        for member, member_ratings in ratings.items():
+            indices = vocabulary.encode(member_ratings['film'])
+            values = member_ratings['rating'].to_numpy(dtype=np.float64)
+            valid = (indices >= 0) & ~np.isnan(values)
+            users.append({'user': member, 'indices': indices[valid].tolist(), 'ratings': values[valid].tolist()})
+
+        response = requests.post(api_base + '/v1/compatibility',
+                                 json={'users': users, 'vocabulary': vocabulary.version, 'min_overlap': min_overlap},
+                                 timeout=BACKEND_TIMEOUT)
+        if response.status_code == 409:
+            raise VocabularyChanged(response.json().get('detail'))
+        response.raise_for_status()
+        body = response.json()
+        # Undefined pairs come back as null, which a float array reads as NaN
+        return cls(body['users'], np.asarray(body['rated']),
+                   {measure: np.array(body[measure], dtype=np.float64) for measure in MEASURES})
+
+    def match(self):
+        """Latent cosine as a 0 to 100 score."""
+        return 50 * (1 + self.measures['latent_cosine'])
+
+    def matrix(self, measure='match'):
+        values = self.match() if measure == 'match' else self.measures[measure]
+        return pd.DataFrame(values, index=self.members, columns=self.members)
+
+    def pairs(self):
+        """One row per pair of members, best matched first."""
+        first, second = np.triu_indices(len(self.members), k=1)
+        frame = pd.DataFrame({'Member': np.asarray(self.members)[first],
+                              'With': np.asarray(self.members)[second],
+                              'Match': self.match()[first, second].round(1),
+                              'Rating correlation': self.measures['correlation'][first, second].round(2),
+                              'Films in common': self.measures['overlap'][first, second].astype(np.int64),
+                              'Jaccard': self.measures['jaccard'][first, second].round(3),
+                              'RMS difference': self.measures['rms_difference'][first, second].round(2)})
+        return frame.sort_values(['Match', 'Films in common'], ascending=False, ignore_index=True)
+
+
+def shared_ratings(first, second):
+    """Films both members rated with both ratings and their difference, biggest disagreements first."""
+    shared = first.dropna(subset=['rating']).merge(second.dropna(subset=['rating']), on='film',
+                                                   suffixes=('_first', '_second'))
+    shared['difference'] = shared['rating_first'] - shared['rating_second']
+    order = np.argsort(-shared['difference'].abs().to_numpy(), kind='stable')
+    return shared.iloc[order].reset_index(drop=True)[['film', 'rating_first', 'rating_second', 'difference']]
@@ -0,0 +1,139 @@
+"""Crawl members' ratings into chunked Parquet files for backend/training.py.
+
+    python crawl_ratings.py members.txt ../backend/data/ratings
+
+members.txt holds one Letterboxd member ID per line. Members already listed in the output's
+_crawled_members.txt are skipped, so an interrupted crawl picks up where it stopped.
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import lbxd
+
+CHUNK_ROWS = 1000000
+# Readers of the directory as a Parquet dataset skip files starting with _ or .
+CRAWLED_MEMBERS = '_crawled_members.txt'
+SCHEMA = pa.schema([('member', pa.dictionary(pa.int32(), pa.string())),
+                    ('film', pa.dictionary(pa.int32(), pa.string())),
+                    ('rating', pa.float32())])
+
+
+class RatingsWriter:
+    """Buffers members' ratings and writes them out as numbered Parquet files of about chunk_rows rows.
+
+    A member is only recorded as crawled once the file holding their ratings is on disk.
+    """
+
+    def __init__(self, out_dir, chunk_rows=CHUNK_ROWS):
+        self.out_dir = out_dir
+        self.chunk_rows = chunk_rows
+        os.makedirs(out_dir, exist_ok=True)
+        self.part = len([f for f in os.listdir(out_dir) if f.startswith('part-') and f.endswith('.parquet')])
+        self.columns = {'member': [], 'film': [], 'rating': []}
+        self.pending = []
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def crawled(self):
+        try:
+            with open(os.path.join(self.out_dir, CRAWLED_MEMBERS), 'r') as f:
+                return set(f.read().split())
+        except FileNotFoundError:
+            return set()
+
+    def write(self, member, entries):
+        # Watched but unrated films are no use for training
+        rated = [x for x in entries if x.get('rating') is not None]
+        with self._lock:
+            self.columns['member'].extend([member] * len(rated))
+            self.columns['film'].extend([x['film'] for x in rated])
+            self.columns['rating'].extend([x['rating'] for x in rated])
+            self.pending.append(member)
+            if len(self.columns['rating']) >= self.chunk_rows:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self.columns['rating']:
+            table = pa.table({'member': pa.array(self.columns['member']).dictionary_encode(),
+                              'film': pa.array(self.columns['film']).dictionary_encode(),
+                              'rating': pa.array(self.columns['rating'], type=pa.float32())}, schema=SCHEMA)
+            name = f'part-{self.part:05d}.parquet'
+            pq.write_table(table, os.path.join(self.out_dir, f'.{name}.tmp'))
+            os.replace(os.path.join(self.out_dir, f'.{name}.tmp'), os.path.join(self.out_dir, name))
+            self.part += 1
+            self.rows += len(table)
+            self.columns = {'member': [], 'film': [], 'rating': []}
+        if self.pending:
+            with open(os.path.join(self.out_dir, CRAWLED_MEMBERS), 'a') as f:
+                f.write(''.join(f'{member}\n' for member in self.pending))
+            self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def crawl_ratings(members, out_dir, max_workers=8, chunk_rows=CHUNK_ROWS, print_every=100):
+    """Fetch every member's ratings into out_dir, returning (members crawled, members that failed)."""
+    with RatingsWriter(out_dir, chunk_rows) as writer:
+        skip = writer.crawled()
+        members = [member for member in dict.fromkeys(members) if member not in skip]
+        print(f'Crawling {len(members)} members, {len(skip)} already done...')
+
+        failed = []
+        done = 0
+        progress = threading.Lock()
+        start = time.perf_counter()
+
+        def crawl_one(member):
+            nonlocal done
+            try:
+                entries = []
+                for page in lbxd.iter_user_ratings(member):
+                    entries.extend(page)
+                writer.write(member, entries)
+            except Exception as e:
+                failed.append(member)
+                print(f'Failed to crawl {member}: {e}')
+            with progress:
+                done += 1
+                if print_every and done % print_every == 0:
+                    print(f'{done}/{len(members)} members, {writer.rows} ratings written, '
+                          f'{done / (time.perf_counter() - start):.1f} members/s')
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            list(executor.map(crawl_one, members))
+
+    return len(members) - len(failed), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('members', help='Text file with one member ID per line.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--workers', type=int, default=8, help='Members crawled at once.')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    # A crawl only reads each page once, caching it would just churn the API cache
+    lbxd.response_cache = None
+    with open(args.members, 'r') as f:
+        members = f.read().split()
+    crawled, failed = crawl_ratings(members, args.out_dir, args.workers, args.chunk_rows)
+    print(f'Crawled {crawled} members into {args.out_dir}, {len(failed)} failed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import hmac
+import random
+import ssl
+import time
+import uuid
+from collections import namedtuple
+from urllib.parse import urlencode
+
+import certifi
+import httpx
+
+CrawlResult = namedtuple('CrawlResult', ['path', 'status', 'data'])
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def signed_url(api_base, path, api_key, api_secret, method='GET'):
+    """Sign a request the way letterboxd.api.API does: HMAC-SHA256 over method, URL and an empty body."""
+    url = f'{api_base}/{path}'
+    unique = urlencode({'apikey': api_key, 'nonce': str(uuid.uuid4()), 'timestamp': int(time.time())})
+    url = f'{url}{"&" if "?" in url else "?"}{unique}'
+    signature = hmac.new(api_secret.encode(), b'\x00'.join([method.encode(), url.encode(), b'']),
+                         digestmod=hashlib.sha256).hexdigest()
+    return f'{url}&signature={signature}'
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncCrawler:
+    """Fetches many API paths concurrently and streams the results back as they land."""
+
+    def __init__(self, api_key, api_secret, api_base, concurrency=50, rate=50.0, max_retries=15,
+                 backoff_base=0.5, backoff_cap=30.0, timeout=30.0):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.api_base = api_base
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+
+    def backoff(self, attempt):
+        # Full jitter keeps retrying workers from synchronising into bursts
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def fetch(self, http, bucket, path):
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                response = await http.get(signed_url(self.api_base, path, self.api_key, self.api_secret))
+            except httpx.TransportError:
+                status = None
+            except httpx.HTTPError:
+                # Not worth retrying, such as too many redirects
+                return CrawlResult(path, None, None)
+            else:
+                status = response.status_code
+                if status == 200:
+                    try:
+                        return CrawlResult(path, status, response.json())
+                    except ValueError:
+                        # A 200 that isn't JSON counts as a failure, data is None
+                        return CrawlResult(path, status, None)
+                if status not in RETRY_STATUSES:
+                    return CrawlResult(path, status, None)
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff(attempt))
+        return CrawlResult(path, status, None)
+
+    async def crawl(self, paths):
+        """Async generator of CrawlResults, in completion order.
+
+        paths can be any iterable, including a lazy one: only about two results per
+        worker are ever held in memory, so the caller's consumption rate sets the pace.
+        """
+        paths = iter(paths)
+        results = asyncio.Queue(maxsize=2 * self.concurrency)
+        bucket = TokenBucket(self.rate)
+        done = object()
+        # Building an SSL context per client costs about a megabyte each, so share one
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+        async def worker():
+            # One keep-alive connection per worker: httpcore's pool rescans every connection
+            # on each request, which dominates CPU time with one large shared pool
+            limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+            async with httpx.AsyncClient(limits=limits, timeout=self.timeout, verify=ssl_context) as http:
+                for path in paths:
+                    await results.put(await self.fetch(http, bucket, path))
+
+        failures = []
+
+        async def close():
+            # Always signal the end, or a worker that died would leave the consumer waiting forever
+            try:
+                failures.extend(e for e in await asyncio.gather(*workers, return_exceptions=True)
+                                if isinstance(e, Exception))
+            finally:
+                await results.put(done)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        tasks = workers + [asyncio.create_task(close())]
+        try:
+            while True:
+                result = await results.get()
+                if result is done:
+                    break
+                yield result
+            if failures:
+                raise failures[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def collect(results, print_every=1000):
+    all_results, missing_urls, failed_urls = [], [], []
+    count = 0
+    async for result in results:
+        if result.status == 200 and result.data is not None:
+            all_results.append(result.data)
+        elif result.status == 404:
+            missing_urls.append(result.path)
+        else:
+            failed_urls.append(result.path)
+        count += 1
+        if print_every and count % print_every == 0:
+            print(f'{count} URLs processed so far.')
+    return all_results, missing_urls, failed_urls
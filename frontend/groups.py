@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import lbxd
+
+MAX_FETCH_WORKERS = 16
+
+
+class GroupWatchlists:
+    """Watchlists of a group of members as integer film indices over one shared vocabulary."""
+
+    def __init__(self, members, watchlists, films):
+        self.members = members
+        # One sorted, duplicate-free int32 array of film indices per member that loaded
+        self.watchlists = watchlists
+        self.films = films
+        self.film_ids = list(films)
+
+    @classmethod
+    def fetch(cls, usernames, max_workers=MAX_FETCH_WORKERS):
+        workers = max(1, min(max_workers, len(usernames)))
+        # Members share the max_workers budget rather than each opening its own window of page requests
+        window = max(1, max_workers // workers)
+
+        def fetch_one(username):
+            try:
+                items = []
+                for page in lbxd.iter_member_watchlist(username, window=window):
+                    items.extend(page)
+                return items
+            except Exception:
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = list(executor.map(fetch_one, usernames))
+
+        films = {}
+        raw = {}
+        for username, items in zip(usernames, fetched):
+            if items is None:
+                raw[username] = None
+                continue
+            for item in items:
+                films.setdefault(item['id'], item)
+            raw[username] = [item['id'] for item in items]
+
+        position = {film: i for i, film in enumerate(films)}
+        watchlists = {username: None if ids is None else np.unique(np.fromiter((position[x] for x in ids), dtype=np.int32, count=len(ids)))
+                      for username, ids in raw.items()}
+        return cls(list(usernames), watchlists, films)
+
+    def loaded(self):
+        return [member for member in self.members if self.watchlists.get(member) is not None and len(self.watchlists[member]) > 0]
+
+    def counts(self):
+        arrays = [self.watchlists[member] for member in self.loaded()]
+        if not arrays:
+            return np.zeros(len(self.film_ids), dtype=np.int64)
+        return np.bincount(np.concatenate(arrays), minlength=len(self.film_ids))
+
+    def overlap(self, min_count=2, limit=None):
+        """Films in at least min_count watchlists, most shared first."""
+        counts = self.counts()
+        candidates = np.flatnonzero(counts >= min_count)
+        order = np.lexsort((candidates, -counts[candidates]))
+        ranked = candidates[order][:limit]
+
+        rows = []
+        for index in ranked:
+            film = self.films[self.film_ids[index]]
+            links = film.get('links') or [{}]
+            rows.append({'id': film['id'],
+                         'Film': film.get('name'),
+                         'Year': film.get('releaseYear'),
+                         'Directed by': ', '.join([x['name'] for x in film.get('directors', [])]),
+                         'Letterboxd URL': links[0].get('url'),
+                         'Count': int(counts[index])})
+        return pd.DataFrame(rows, columns=['id', 'Film', 'Year', 'Directed by', 'Letterboxd URL', 'Count'])
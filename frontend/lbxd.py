@@ -1,21 +1,91 @@
-import letterboxd
 import requests
 import pandas as pd
 
+import os
+import re
+import threading
+
+from requests.adapters import HTTPAdapter
+
+from api_cache import ApiCache
+from timing import timed
+
+API_BASE = os.environ.get('LETTERBOXD_API_BASE', 'https://api.letterboxd.com/api/v0')
+WEB_BASE = os.environ.get('LETTERBOXD_WEB_BASE', 'https://letterboxd.com')
+# Matches threaded_api_request's default thread count so no thread waits for a connection
+POOL_SIZE = int(os.environ.get('LBXD_POOL_SIZE', 50))
+PAGE_SIZE = 100
+# How many pages of ratings or watchlist are requested ahead of the one being read
+PAGE_WINDOW = int(os.environ.get('LBXD_PAGE_WINDOW', 8))
+
+# An empty LBXD_CACHE_PATH turns the persistent cache off
+response_cache = ApiCache() if os.environ.get('LBXD_CACHE_PATH', None) != '' else None
+
 def get_credentials(path='credentials.txt'):
     with open(path, 'r') as f:
         credentials = f.read().split('\n')
     return credentials
 
-def api_request(path):
-    key, secret = get_credentials()
-    api_base = 'https://api.letterboxd.com/api/v0'
+class LetterboxdClient:
+    
+    def __init__(self, credentials_path='credentials.txt', api_base=API_BASE, web_base=WEB_BASE, pool_size=POOL_SIZE):
+        self.credentials_path = credentials_path
+        self.api_base = api_base
+        self.web_base = web_base
+        self.pool_size = pool_size
+        self._api = None
+        self._web = None
+        self._lock = threading.Lock()
+        
+    def mount_pool(self, session):
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+        
+    @property
+    def credentials(self):
+        return self.api.api_key, self.api.api_secret
+        
+    @property
+    def api(self):
+        # Credentials are read and the keep-alive session is built once, on first use
+        if self._api is None:
+            with self._lock:
+                if self._api is None:
+                    import letterboxd
+                    key, secret = get_credentials(self.credentials_path)[:2]
+                    api = letterboxd.api.API(api_base=self.api_base, api_key=key, api_secret=secret)
+                    self.mount_pool(api.session)
+                    self._api = api
+        return self._api
     
-    return letterboxd.api.API(api_base=api_base, api_key=key, api_secret=secret).api_call(path)
+    @property
+    def web(self):
+        if self._web is None:
+            with self._lock:
+                if self._web is None:
+                    self._web = self.mount_pool(requests.Session())
+        return self._web
+    
+    def get(self, path, headers=None):
+        return self.api.api_call(path, params={}, headers=dict(headers or {}))
+    
+    def head(self, page):
+        return self.web.head(f'{self.web_base}/{page}')
+
+client = LetterboxdClient()
 
+@timed('api_request')
+def api_request(path, revalidate=False):
+    if response_cache is None:
+        return client.get(path)
+    return response_cache.fetch(path, lambda headers: client.get(path, headers), revalidate=revalidate)
+
+@timed('username_lookup')
 def get_id_from_username(member_name):
 
-    head_request = requests.head(f'https://letterboxd.com/{member_name}/')
+    head_request = client.head(f'{member_name}/')
     status_code = head_request.status_code
     if status_code != 200:
         raise ValueError(f'Request failed when looking up member {member_name}.\
@@ -29,68 +99,133 @@ def get_id_from_username(member_name):
     return member_id
 
 
-def get_member_watchlist(member_name='', member_id=None):
+def fetch_page(path, cursor, description, revalidate=False):
+    
+    response = api_request(f'{path}&cursor={cursor}', revalidate=revalidate)
+    if response.status_code != 200:
+        raise ValueError(f'Request failed when pulling {description}.\
+                           Status code: {response.status_code}')
+    
+    return response.json()
+
+
+def paginate(path, description='page', window=PAGE_WINDOW, revalidate=False):
+    
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    
+    page = fetch_page(path, 'start=0', description, revalidate)
+    yield page['items']
+    cursor = page.get('next')
+    offset = re.fullmatch(r'start=(\d+)', cursor) if cursor else None
+    
+    if cursor and (offset is None or window <= 1):
+        # Opaque cursors can only be followed one page at a time
+        while cursor:
+            page = fetch_page(path, cursor, description, revalidate)
+            yield page['items']
+            cursor = page.get('next')
+        return
+    if not cursor:
+        return
+    
+    # Offset cursors let us request the next pages before the current one lands.
+    # Pages past the end come back empty and are dropped once the last page is seen.
+    page_size = int(offset.group(1))
+    next_start = page_size
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = deque()
+        for _ in range(window):
+            pending.append(executor.submit(fetch_page, path, f'start={next_start}', description, revalidate))
+            next_start += page_size
+        while pending:
+            page = pending.popleft().result()
+            yield page['items']
+            if 'next' not in page:
+                for future in pending:
+                    future.cancel()
+                break
+            pending.append(executor.submit(fetch_page, path, f'start={next_start}', description, revalidate))
+            next_start += page_size
+
+
+def iter_member_watchlist(member_name='', member_id=None, window=PAGE_WINDOW):
     
     if not member_id:
         member_id = get_id_from_username(member_name)
-        
-    full_results = []
     
-    def paginate_watchlist(cursor='start=0'):    
-        wl_response = api_request(f'member/{member_id}/watchlist?perPage=100&cursor={cursor}')
-        wl_response_status = wl_response.status_code
-        if wl_response_status != 200:
-            raise ValueError(f'Request failed when pulling watchlist for member ID {member_id}.\
-                               Status code: {wl_response_status}')
-        wl_json = wl_response.json()
-        full_results.extend(wl_json['items'])
-        if 'next' in wl_json.keys():
-            paginate_watchlist(cursor=wl_json['next'])
+    yield from paginate(f'member/{member_id}/watchlist?perPage={PAGE_SIZE}', f'watchlist for member ID {member_id}',
+                        window)
+
+
+@timed('watchlist_fetch')
+def get_member_watchlist(member_name='', member_id=None, on_page=None, window=PAGE_WINDOW):
+    
+    full_results = []
     
-    paginate_watchlist(full_results)
+    for items in iter_member_watchlist(member_name, member_id, window):
+        full_results.extend(items)
+        if on_page:
+            on_page(full_results)
     
     return pd.DataFrame(full_results)
 
-def get_combined_watchlists(members):
-    
-    watchlists = []
+
+def parse_rating(member, item):
     
-    for member in members:
-        watchlist = get_member_watchlist(member)
-        watchlists.append(watchlist)
+    entry = {'member': member}
+    entry['film'] = item.get('id')
+    relationships = item.get('relationships')
+    if relationships:
+        relationship = relationships[0].get('relationship')
+        if relationship:
+            entry['rating'] = relationship.get('rating')
     
-    combined_watchlist = pd.concat(watchlists)
+    return entry
+
+
+def iter_user_ratings(member, sort='MemberRatingHighToLow', window=PAGE_WINDOW, revalidate=False):
     
-    return combined_watchlist
+    path = f'films/?perPage={PAGE_SIZE}&member={member}&memberRelationship=Watched&sort={sort}'
+    for items in paginate(path, f'ratings for member ID {member}', window, revalidate):
+        yield [parse_rating(member, item) for item in items]
 
 
-def get_user_ratings(member):
+@timed('ratings_fetch')
+def get_user_ratings(member, on_page=None):
     
-    cursor = 'start=0'
-    results = {'next':None}
     all_ratings = []
-
-    while True:
-        response = api_request(
-            f'films/?perPage=100&member={member}&memberRelationship=Watched&sort=MemberRatingHighToLow&cursor={cursor}')
-        results = response.json()
-        for item in results['items']:
-            entry = {'member': member}
-            entry['film'] = item.get('id')
-            relationships = item.get('relationships')
-            if relationships:
-                relationship = relationships[0].get('relationship')
-                if relationship:
-                    entry['rating'] = relationship.get('rating')
-            all_ratings.append(entry)
-        if 'next' not in results:
-            break
-        else:
-            cursor = results['next']
+    
+    for entries in iter_user_ratings(member):
+        all_ratings.extend(entries)
+        if on_page:
+            on_page(all_ratings)
         
     return pd.DataFrame(all_ratings)
 
 
+def stream_api_request(url_list, max_retries=15, concurrency=50, rate=50.0):
+    
+    from crawler import AsyncCrawler
+    
+    key, secret = client.credentials
+    crawler = AsyncCrawler(key, secret, client.api_base, concurrency=concurrency, rate=rate, max_retries=max_retries)
+    
+    return crawler.crawl(url_list)
+
+
+def bulk_api_request(url_list, max_retries=15, concurrency=50, rate=50.0, print_every=1000):
+    
+    import asyncio
+    from crawler import collect
+    
+    print('Running scraper...')
+    results = stream_api_request(url_list, max_retries=max_retries, concurrency=concurrency, rate=rate)
+    
+    return asyncio.run(collect(results, print_every=print_every))
+
+
+# Superseded by bulk_api_request/stream_api_request, kept for comparison in benchmarks/bench_bulk_crawl.py
 def threaded_api_request(url_list, max_retries=15, max_threads=50, print_every=1000):
     
     from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -0,0 +1,38 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Histogram, start_http_server
+
+# Set to serve this process's stage timings for Prometheus on that port
+METRICS_PORT = os.environ.get('FRONTEND_METRICS_PORT')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram('frontend_stage_seconds', 'Time spent in each stage of the Streamlit tools.',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+
+_started = False
+_lock = threading.Lock()
+
+
+@contextmanager
+def timed(stage):
+    """Record how long the block takes under stage in frontend_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def serve_metrics(port=METRICS_PORT):
+    """Start the metrics server once per process. Streamlit reruns scripts, so this gets called a lot."""
+    global _started
+    if not port:
+        return
+    with _lock:
+        if not _started:
+            start_http_server(int(port))
+            _started = True
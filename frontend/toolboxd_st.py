@@ -1,22 +1,14 @@
 import streamlit as st
 import streamlit_analytics
 
-import pandas as pd
-import numpy as np
-
 from collections import OrderedDict
-import os
 
 st.set_page_config(page_title='Toolboxd', page_icon='🎬')
 
-files = os.listdir()
-try:
-    analytics_password = [f.replace('.pass', '') for f in files if '.pass' in f][0]
-except:
-    analytics_password = 'password'
-
 import tools
 
+analytics_password = tools.get_analytics_password()
+
 # Dictionary of
 # demo_name -> (demo_function, demo_description)
 TOOLS = OrderedDict(
@@ -1,7 +1,6 @@
 import streamlit as st
 import streamlit_analytics
-import lbxd
-import utils
+import timing
 
 import pandas as pd
 import numpy as np
@@ -9,7 +8,10 @@ import os
 
 import requests
 
-@st.cache_data(show_spinner=False)
+# The frontend's own modules are imported by the tools that use them, so the first render doesn't wait on them
+
+# Shared with toolboxd_st.py, so the working directory is scanned once per process
+@st.cache_resource(show_spinner=False)
 def get_analytics_password():
     files = os.listdir()
     try:
@@ -19,48 +21,76 @@ def get_analytics_password():
     return analytics_password
 
 analytics_password = get_analytics_password()
-
-@st.cache_data(show_spinner=False)
-def load_film_data():
-    return pd.read_pickle('data/film_data.p')
-
-@st.cache_data(show_spinner=False)
-def get_user_ratings(username):
-    try:
+timing.serve_metrics()
+
+# BACKEND_URL skips discovery, otherwise the candidates are probed in order
+BACKEND_CANDIDATES = os.environ.get('BACKEND_CANDIDATES', 'http://localhost:8000,http://backend:8000').split(',')
+BACKEND_DISCOVERY_TIMEOUT = float(os.environ.get('BACKEND_DISCOVERY_TIMEOUT', 1))
+
+# A resource rather than data so sessions share the memory-mapped table instead of copying it
+@st.cache_resource(show_spinner=False)
+def load_film_catalogue():
+    import catalogue
+    return catalogue.load_catalogue()
+
+# Not st.cache_data, which can't replay on_page drawing into the page. user_sync already makes a repeat
+# visit cost only the films logged since, and the session keeps the ratings so reruns don't sync again.
+def get_user_ratings(username, on_page=None):
+    import lbxd
+    import user_sync
+    fetched = st.session_state.get('user_ratings')
+    if fetched is None or fetched[0] != username:
         user_id = lbxd.get_id_from_username(username)
-        ratings = lbxd.get_user_ratings(user_id)
-        return ratings
-    except:
-        return None
+        fetched = username, user_sync.sync_user_ratings(user_id, on_page=on_page)
+        st.session_state['user_ratings'] = fetched
+    return fetched[1]
 
 @st.cache_data(show_spinner=False)
 def fetch_watchlist(username):
+        import lbxd
         try:
             user_watchlist = lbxd.get_member_watchlist(username)
             return user_watchlist
         except:
             return None
-            
-@st.cache_data(show_spinner=False)
+
+@st.cache_resource(show_spinner=False)
 def discover_api_base():
-    api_base = 'http://localhost:8000'
+    for api_base in BACKEND_CANDIDATES:
+        try:
+            requests.get(api_base+'/', timeout=BACKEND_DISCOVERY_TIMEOUT)
+            return api_base
+        except requests.RequestException:
+            pass
+    # Raising keeps the miss out of the cache, so the next run probes again
+    raise ConnectionError(f'No backend answered at {", ".join(BACKEND_CANDIDATES)}')
+
+def get_api_base():
+    if os.environ.get('BACKEND_URL'):
+        return os.environ['BACKEND_URL']
     try:
-        requests.get(api_base+'/')
-        return api_base
-    except:
-        api_base = 'http://backend:8000'
-        requests.get(api_base+'/')
-        return api_base
-        
-
-API_BASE = discover_api_base()
-film_data = load_film_data()
+        return discover_api_base()
+    except ConnectionError:
+        # Most likely still starting up, requests to the last candidate fail where they're made
+        return BACKEND_CANDIDATES[-1]
+
+# The model's film vocabulary plus each film's catalogue row, refreshed when the backend swaps models
+@st.cache_resource(show_spinner=False, ttl=600)
+def load_vocabulary():
+    import vocabulary
+    model_vocabulary = vocabulary.Vocabulary.fetch(get_api_base())
+    return model_vocabulary, load_film_catalogue().locate(model_vocabulary.ids)
+
+# The picks grid shows ranks 4 to 12
+RECOMMENDATION_COUNT = 12
+BACKEND_UNAVAILABLE = "Sorry, we couldn't reach our recommendation server. Please try again in a minute."
 
 def intro():
     st.sidebar.success("Select a tool above.")
     
 
 def random_movie_picker():
+    import utils
 
     st.write("## Can't pick a movie?\nRandomly select one from your watchlist!")
 
@@ -73,26 +103,27 @@ def random_movie_picker():
             
         if user_watchlist is not None:
             if len(user_watchlist) > 0:
-                user_watchlist = user_watchlist.merge(film_data[['id', 'rating', 'runTime', 'popularity', 'countries', 'tagline', 'description']], how='left', on='id')
                 st.success('Watchlist loaded successfully.')
                 year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres = utils.get_filters()
                 movies_to_sample = st.slider('How many films do you want to pick?', 1, 10, 1, key='random_picker_sample_count')
                 if st.button('Get random movie!'):
-                    filtered_watchlist = utils.filter_movie_list(user_watchlist, year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres)
+                    with timing.timed('filter_request'):
+                        filtered_watchlist = utils.filter_movie_list(user_watchlist, load_film_catalogue(), get_api_base(), year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres)
                     if len(filtered_watchlist) < movies_to_sample:
                         st.error('Sorry, your filters did not leave enough movies to pick from. Try easing up.')
                     else:
                         full_sample = filtered_watchlist.sample(movies_to_sample).reset_index()
+                        columns = ['tagline', 'description', 'directors', 'poster_url', 'links']
+                        details = load_film_catalogue().lookup(full_sample['id'], columns)
+                        full_sample[columns] = details[columns]
                         for idx, sample in full_sample.iterrows():
-                            movie_directors = ', '.join(
-                                [x['name'] for x in sample['directors']])
+                            movie_directors = sample['directors'] if isinstance(sample['directors'], str) else ''
                             movie_release_year = sample['releaseYear']
                             movie_title = sample['name']
                             movie_tagline = sample['tagline']
                             movie_description = sample['description']
-                            movie_poster_url = sample['poster']['sizes'][-1]['url'] if len(
-                                sample['poster'].get('sizes')) >= 1 else ''
-                            movie_links = [x['url'] for x in sample['links']]
+                            movie_poster_url = sample['poster_url']
+                            movie_links = sample['links'] if sample['links'] is not None else []
                             st.markdown(f'# {movie_title}')
                             if movie_poster_url:
                                 st.image(f"{movie_poster_url}", width=300)
@@ -116,54 +147,44 @@ def random_movie_picker():
 
 
 def group_watchlist_picker():
+    import groups
 
     st.write("## Having trouble picking a film as a group?")
     st.write("Find common movies in your watchlists!")
 
-    @st.cache_data(show_spinner=False)
-    def fetch_watchlist(username):
-        with st.spinner(f'Please wait a moment while we fetch the watchlist for {username}...'):
-            try:
-                user_watchlist = lbxd.get_member_watchlist(username)
-                return user_watchlist
-            except:
-                return None
+    @st.cache_data(show_spinner=False, ttl=3600)
+    def fetch_watchlists(usernames):
+        with timing.timed('group_fetch'):
+            return groups.GroupWatchlists.fetch(list(usernames))
 
-    count = st.slider('How many of you are there?', 2, 10)
+    count = st.slider('How many of you are there?', 2, 60)
     all_users = []
 
     for i in range(0, count):
         user = st.text_input(f'Letterboxd username for #{i+1}')
         all_users.append(user)
 
+    min_count = st.slider('Show films in at least how many watchlists?', 2, count) if count > 2 else 2
+
     if len(all_users) == len([x for x in all_users if x]):
         if st.button('All done?'):
 
-            all_watchlists = []
+            with st.spinner(f'Please wait a moment while we fetch {count} watchlists...'):
+                group = fetch_watchlists(tuple(all_users))
+
+            loaded = group.loaded()
             for user in all_users:
-                user_watchlist = fetch_watchlist(user)
-                if user_watchlist is not None and len(user_watchlist) > 0:
-                    st.success(f'Successfully pulled watchlist for {user}')
-                    all_watchlists.append(user_watchlist)
-                else:
+                if user not in loaded:
                     st.error(
                         f'There was a problem getting the watchlist for {user}')
+            st.success(f'Successfully pulled {len(loaded)} of {count} watchlists')
 
-            combined = pd.concat(all_watchlists)
-            counts = combined.groupby('id')['name'].count().sort_values()
-            combined['Count'] = combined['id'].apply(lambda x: counts[x])
-            combined = combined.drop_duplicates(
-                subset=['id']).sort_values(by='Count', ascending=False)
-            combined['Film'] = combined['name']
-            combined['Year'] = combined['releaseYear']
-            combined['Directed by'] = combined['directors'].apply(
-                lambda x: ', '.join([y['name'] for y in x]))
-            combined['Letterboxd URL'] = combined['links'].str[0].str['url']
-            results = combined[combined['Count'] >= 2].copy()
+            with timing.timed('group_overlap'):
+                results = group.overlap(min_count)
 
             if len(results) > 0:
                 st.write(
-                    'Here are the movies that show up in at least 2 watchlists for this group:')
+                    f'Here are the movies that show up in at least {min_count} watchlists for this group:')
                 st.table(
                     results[['Film', 'Year', 'Directed by', 'Letterboxd URL', 'Count']])
             else:
@@ -177,27 +198,104 @@ def group_watchlist_picker():
 
 
 def movie_compatibility_score():
+    import compatibility
+    import vocabulary
 
-    st.title('Coming soon!')
+    st.write("## How compatible is your taste in film?")
+    st.write("Compare ratings with a friend, or see who in your group agrees the most.")
 
-    pass
+    @st.cache_data(show_spinner=False, ttl=600)
+    def fetch_ratings(usernames):
+        with timing.timed('group_ratings_fetch'):
+            return compatibility.fetch_ratings(list(usernames))
 
+    with st.spinner('Please wait a second while we set things up - loading film and model data...'):
+        try:
+            model_vocabulary, _ = load_vocabulary()
+        except requests.RequestException:
+            st.error(BACKEND_UNAVAILABLE)
+            return
 
-def recommendation_system():
+    count = st.slider('How many of you are there?', 2, compatibility.MAX_GROUP_USERS)
+    all_users = []
 
-    @st.cache_data(show_spinner=False)
-    def model_api_get(url):
-        return requests.get(API_BASE+url).json()
+    for i in range(0, count):
+        user = st.text_input(f'Letterboxd username for #{i+1}')
+        all_users.append(user)
 
-    def model_api_post(url):
-        return requests.post(API_BASE+url).json()
+    if len(all_users) != len([x for x in all_users if x]):
+        st.info(
+            """Looks like we're still missing some folks! Make sure you fill in every box.""")
+        return
+
+    if not st.button('Compare'):
+        return
+
+    with st.spinner(f'Please wait a moment while we fetch {count} sets of ratings...'):
+        ratings = fetch_ratings(tuple(all_users))
+
+    loaded = {}
+    for user in all_users:
+        if ratings.get(user) is None or len(ratings[user].dropna(subset=['rating'])) == 0:
+            st.error(f'There was a problem getting the ratings for {user}')
+        else:
+            loaded[user] = ratings[user]
+    if len(loaded) < 2:
+        st.error('We need ratings from at least two of you to compare.')
+        return
+
+    with st.spinner('Comparing your tastes...'):
+        with timing.timed('compatibility_request'):
+            try:
+                try:
+                    result = compatibility.GroupCompatibility.request(get_api_base(), model_vocabulary, loaded)
+                except vocabulary.VocabularyChanged:
+                    load_vocabulary.clear()
+                    model_vocabulary, _ = load_vocabulary()
+                    result = compatibility.GroupCompatibility.request(get_api_base(), model_vocabulary, loaded)
+            except requests.RequestException:
+                st.error(BACKEND_UNAVAILABLE)
+                return
+
+    pairs = result.pairs()
+    if len(loaded) == 2:
+        first, second = result.members
+        pair = pairs.iloc[0]
+        st.metric('Taste match', f"{pair['Match']:.0f}%")
+        st.write(f"You've both rated **{pair['Films in common']} films**.")
+        if pd.notna(pair['Rating correlation']):
+            st.write(
+                f"On those, your ratings have a correlation of **{pair['Rating correlation']:.2f}** and are **{pair['RMS difference']:.2f} stars** apart on average.")
+
+        shared = compatibility.shared_ratings(loaded[first], loaded[second])
+        if len(shared) > 0:
+            with timing.timed('catalogue_lookup'):
+                names = load_film_catalogue().lookup(shared['film'], ['name'])['name']
+            shared = pd.DataFrame({'Film': names.fillna(shared['film']), first: shared['rating_first'],
+                                   second: shared['rating_second']})
+            st.write('The films you disagree on the most:')
+            st.table(shared.head(10))
+    else:
+        st.write('Here is how every pair in your group matches up:')
+        st.table(pairs)
+        st.write('Taste match between every member, out of 100:')
+        st.dataframe(result.matrix().round(0))
+
+
+def recommendation_system():
+    import utils
+    import vocabulary
 
     st.title("So many movies, so little time!")
     st.write(
         "To make it easier, we'll use fancy math to figure out which ones we think you'll like.")
 
     with st.spinner('Please wait a second while we set things up - loading film and model data...'):
-        model_movies = model_api_get('/model_items')['items']
+        try:
+            model_vocabulary, catalogue_rows = load_vocabulary()
+        except requests.RequestException:
+            st.error(BACKEND_UNAVAILABLE)
+            return
 
     user_ratings = None
     user_watchlist = None
@@ -207,12 +305,20 @@ def recommendation_system():
 
     if username:
         with st.spinner('Please wait while we grab your ratings and watchlist. If you have a lot, it could take a while.'):
+            progress = st.empty()
+            
+            def show_progress(ratings_so_far):
+                rated = [x['rating'] for x in ratings_so_far if x.get('rating') is not None]
+                if rated:
+                    progress.write(f'Fetched **{len(rated)} ratings** so far, averaging **{np.mean(rated):.2f} stars**...')
+            
             try:
-                user_ratings = get_user_ratings(username)
+                user_ratings = get_user_ratings(username, on_page=show_progress)
+                progress.empty()
                 user_watchlist = fetch_watchlist(username)
                 st.write(
                     f"Looks like you've rated **{len(user_ratings.dropna(subset=['rating']))} films**, giving an average rating of **{user_ratings['rating'].mean():.2f} stars**.")
-            except:
+            except (ValueError, KeyError, requests.RequestException):
                 st.error(
                     "Sorry, we couldn't get the ratings for that user. Try again.")
                 user_ratings = None
@@ -222,11 +328,29 @@ def recommendation_system():
         
         year_range, runtime_range, popularity_range, rating_range, include_watchlist, country_specification, include_genres = utils.get_filters(hide_watchlist_filter=False)
             
-        valid_ratings = user_ratings.dropna(subset=['rating'])
-        valid_ratings = valid_ratings[valid_ratings['film'].isin(model_movies)]
         user = user_ratings['member'].iloc[0]
-
-        if len(valid_ratings) < 30:
+        watchlist_films = user_watchlist['id'] if user_watchlist is not None and len(user_watchlist) > 0 and include_watchlist == False else []
+        filters = utils.pack_filters(year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres)
+
+        # Everything works on model indices, film IDs only come back for display
+        def encode_ratings(model_vocabulary, catalogue_rows):
+            rated_indices = model_vocabulary.encode(user_ratings['film'])
+            ratings = user_ratings['rating'].to_numpy(dtype=np.float64)
+            valid = (rated_indices >= 0) & ~np.isnan(ratings)
+            excluded = model_vocabulary.bitset(rated_indices) | model_vocabulary.bitset(model_vocabulary.encode(watchlist_films))
+            if not model_vocabulary.film_index:
+                # The backend has nothing to filter with, so leave out the films the catalogue says don't pass
+                excluded |= ~load_film_catalogue().mask(catalogue_rows, **filters)
+            return rated_indices[valid], ratings[valid], np.flatnonzero(excluded)
+
+        def request_predictions(model_vocabulary, catalogue_rows):
+            valid_indices, valid_ratings, excluded = encode_ratings(model_vocabulary, catalogue_rows)
+            options = {'user': user, 'relative': True, 'filters': filters if model_vocabulary.film_index else None}
+            with timing.timed('recommendation_request'):
+                return vocabulary.post_packed(get_api_base(), model_vocabulary, valid_indices, valid_ratings, excluded,
+                                              RECOMMENDATION_COUNT, options)
+
+        if len(encode_ratings(model_vocabulary, catalogue_rows)[1]) < 30:
             st.warning(
                 "Warning: you don't have that many ratings. To improve recommendations, rate more movies! 30 or so is a good start.")
             
@@ -235,28 +359,27 @@ def recommendation_system():
 
         if st.button('Generate predictions'):
             with st.spinner('Training model with your ratings and generating predictions...'):
-                item_list = ','.join([x[1] for x in valid_ratings.values])
-                rating_list = ','.join([str(x[2])
-                                        for x in valid_ratings.values])
-                pred_url = f'/get_recommendations/user={user}&item_list={item_list}&rating_list={rating_list}'
-                predictions = model_api_post(pred_url)['results']
-
-            predictions = pd.DataFrame(predictions)
-            predictions = predictions.merge(
-                film_data[['id', 'name', 'rating', 'poster', 'links', 'releaseYear', 'runTime', 'popularity', 'countries', 'genres']], how='left', left_on='film', right_on='id')
-            predictions['difference'] = predictions['prediction'] - predictions['rating']
-            predictions['score'] = predictions['prediction'] + predictions['difference']
-            predictions = predictions[~predictions['film'].isin(user_ratings['film'])]
-
-            predictions = predictions.sort_values(by='score', ascending=False)
-            if user_watchlist is not None and len(user_watchlist) > 0 and include_watchlist == False:
-                predictions = predictions[~predictions['film'].isin(user_watchlist['id'])]
-                
-            predictions = utils.filter_movie_list(predictions, year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres)
-            
-            if len(predictions) < 10:
+                try:
+                    try:
+                        response = request_predictions(model_vocabulary, catalogue_rows)
+                    except vocabulary.VocabularyChanged:
+                        # The backend swapped models since we fetched the vocabulary, so encode again
+                        load_vocabulary.clear()
+                        model_vocabulary, catalogue_rows = load_vocabulary()
+                        response = request_predictions(model_vocabulary, catalogue_rows)
+                except requests.RequestException:
+                    st.error(BACKEND_UNAVAILABLE)
+                    return
+            predictions = response['results']
+            if 'relative' in response.get('unapplied', []):
+                st.info("We couldn't compare these films with their Letterboxd averages right now, so they're ranked by predicted rating alone.")
+
+            if len(predictions) < RECOMMENDATION_COUNT:
                 st.error('Sorry, your filters did not leave enough films to make recommendations. Try easing up.')
             else:
+                predictions = pd.DataFrame(predictions)
+                with timing.timed('catalogue_lookup'):
+                    predictions = load_film_catalogue().take(catalogue_rows[predictions['index']], ['name', 'poster_url', 'letterboxd_url'])
                 st.header('Here are your picks')
                 st.write(
                     "Based on what you're into, we feel like you should give these movies a chance:")
@@ -274,9 +397,8 @@ def recommendation_system():
                         for col_idx, col in enumerate(st.columns(3)):
                             i = (row+1)*3 + col_idx
                             movie = predictions.iloc[i]
-                            movie_poster = movie['poster']['sizes'][-1]['url'] if len(
-                                movie['poster'].get('sizes')) >= 1 else ''
-                            letterboxd_link = movie['links'][0]['url']
+                            movie_poster = movie['poster_url']
+                            letterboxd_link = movie['letterboxd_url']
                             poster_html = f"""<a href="{letterboxd_link}"> <img src="{movie_poster}" width=100%> </a>"""
                             col.markdown(poster_html, unsafe_allow_html=True)
                             col.write
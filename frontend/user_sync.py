@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+import lbxd
+from timing import timed
+
+SYNC_PATH = os.environ.get('LBXD_SYNC_PATH', 'cache/user_ratings.sqlite')
+# Re-rating an old film or deleting a log doesn't move anything to the front of the
+# date-sorted list, so incremental syncs miss those until the next full one
+FULL_SYNC_INTERVAL = float(os.environ.get('LBXD_FULL_SYNC_INTERVAL', 7 * 24 * 3600))
+
+
+class RatingsStore:
+    """Each member's ratings as of their last sync, persisted in sqlite."""
+
+    def __init__(self, path=SYNC_PATH, full_sync_interval=FULL_SYNC_INTERVAL):
+        self.path = path
+        self.full_sync_interval = full_sync_interval
+        self._local = threading.local()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS ratings (
+                              member TEXT, film TEXT, rating REAL, PRIMARY KEY (member, film))""")
+            db.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+                              member TEXT PRIMARY KEY, synced_at REAL, full_synced_at REAL)""")
+
+    def connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def state(self, member):
+        row = self.connection().execute('SELECT synced_at, full_synced_at FROM sync_state WHERE member = ?',
+                                        (member,)).fetchone()
+        return row if row is not None else (None, None)
+
+    def known(self, member):
+        rows = self.connection().execute('SELECT film, rating FROM ratings WHERE member = ?', (member,))
+        return dict(rows.fetchall())
+
+    def ratings(self, member):
+        rows = self.connection().execute('SELECT member, film, rating FROM ratings WHERE member = ? '
+                                         'ORDER BY rating DESC NULLS LAST, film', (member,)).fetchall()
+        return pd.DataFrame(rows, columns=['member', 'film', 'rating'])
+
+    def merge(self, member, entries, full=False):
+        """Upsert entries for member. A full sync replaces everything, so films removed upstream go too."""
+        now = time.time()
+        with self.connection() as db:
+            if full:
+                db.execute('DELETE FROM ratings WHERE member = ?', (member,))
+            db.executemany('INSERT OR REPLACE INTO ratings VALUES (?, ?, ?)',
+                           [(member, x['film'], x.get('rating')) for x in entries])
+            _, full_synced_at = self.state(member)
+            db.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)',
+                       (member, now, now if full else full_synced_at))
+
+    def needs_full_sync(self, member):
+        _, full_synced_at = self.state(member)
+        return full_synced_at is None or time.time() - full_synced_at > self.full_sync_interval
+
+    def sync(self, member, on_page=None, full=None):
+        """Bring member's stored ratings up to date and return them as a DataFrame.
+
+        Incremental syncs walk the member's films newest first and stop after the first page
+        that reaches a film already stored with the same rating, usually one request.
+        """
+        if full is None:
+            full = self.needs_full_sync(member)
+
+        # Always revalidate: a stale page from the API cache could undo the last incremental sync
+        fetched = []
+        if full:
+            for entries in lbxd.iter_user_ratings(member, revalidate=True):
+                fetched.extend(entries)
+                if on_page:
+                    on_page(fetched)
+        else:
+            known = self.known(member)
+            # Pages are requested one at a time since we expect to stop early
+            for entries in lbxd.iter_user_ratings(member, sort='DateLatestFirst', window=1, revalidate=True):
+                fetched.extend(entries)
+                if on_page:
+                    on_page(fetched)
+                if any(x['film'] in known and known[x['film']] == x.get('rating') for x in entries):
+                    break
+
+        self.merge(member, fetched, full=full)
+        return self.ratings(member)
+
+
+# An empty LBXD_SYNC_PATH turns the store off and every visit fetches everything again
+ratings_store = RatingsStore() if SYNC_PATH != '' else None
+
+
+@timed('ratings_sync')
+def sync_user_ratings(member, on_page=None):
+    if ratings_store is None:
+        return lbxd.get_user_ratings(member, on_page=on_page)
+    return ratings_store.sync(member, on_page=on_page)
@@ -1,13 +1,9 @@
 import streamlit as st
-import streamlit_analytics
-import lbxd
-
-import pandas as pd
-import numpy as np
-import os
 
 import requests
 
+from vocabulary import BACKEND_TIMEOUT
+
 def get_filters(hide_watchlist_filter=True):
     
     with st.expander('Advanced filters'):
@@ -45,22 +41,23 @@ def get_filters(hide_watchlist_filter=True):
         return year_range, runtime_range, popularity_range, rating_range, include_watchlist, country_specification, include_genres
     
 
-def filter_movie_list(movie_list, year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres):
+def pack_filters(year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres):
+    
+    return {'year_range': year_range, 'runtime_range': runtime_range, 'popularity_range': popularity_range,
+            'rating_range': rating_range, 'country_specification': country_specification or None,
+            'include_genres': include_genres}
+
+
+def filter_movie_list(movie_list, film_catalogue, api_base, year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres):
     
-        if year_range:
-            movie_list = movie_list[movie_list['releaseYear'].between(year_range[0], year_range[1])]
-        if runtime_range:
-            movie_list = movie_list[movie_list['runTime'].between(runtime_range[0], runtime_range[1])]
-        if popularity_range:
-            movie_list = movie_list[movie_list['popularity'].between(popularity_range[0], popularity_range[1])]
-        if country_specification:
-            country_filter = movie_list['countries'].apply(lambda x: country_specification in [c.get('code') for c in x] if type(x) == list else False)
-            movie_list = movie_list[country_filter]
-        if rating_range:
-            movie_list = movie_list[movie_list['rating'].between(rating_range[0], rating_range[1])]
-        if include_genres:
-            movie_list['genre_names'] = movie_list['genres'].apply(lambda x: [y['name'] for y in x])
-            valid_genres = movie_list['genre_names'].apply(lambda x: any(genre in include_genres for genre in x))
-            movie_list = movie_list[valid_genres]
+        filters = pack_filters(year_range, runtime_range, popularity_range, rating_range, country_specification, include_genres)
+        try:
+            response = requests.post(api_base+'/filter_items', json={'items': movie_list['id'].tolist(), 'filters': filters},
+                                     timeout=BACKEND_TIMEOUT)
+            response.raise_for_status()
+            kept = response.json()['items']
+        except requests.RequestException:
+            # No backend, or one without a film index, so filter against the local catalogue instead
+            return movie_list[film_catalogue.mask(film_catalogue.locate(movie_list['id']), **filters)]
             
-        return movie_list
\ No newline at end of file
+        return movie_list[movie_list['id'].isin(kept)]
\ No newline at end of file
@@ -0,0 +1,73 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+import requests
+
+# Seconds any call to the backend may take before the frontend gives up on it
+BACKEND_TIMEOUT = float(os.environ.get('BACKEND_TIMEOUT', 30))
+
+# Must match backend/schemas.py, benchmarks/suite.py checks that the backend reads back what pack_ratings writes
+PACKED_MAGIC = b'LBR1'
+PACKED_HEADER = struct.Struct('<4sIIi')
+
+
+class VocabularyChanged(Exception):
+    pass
+
+
+class Vocabulary:
+    """The backend model's film IDs in index order. Films travel as int32 indices into this list."""
+
+    def __init__(self, ids, version=None, model=None, film_index=True):
+        self.ids = pd.Index(ids)
+        self.version = version
+        self.model = model
+        # Whether the backend can apply the film filters itself
+        self.film_index = film_index
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def fetch(cls, api_base):
+        response = requests.get(api_base + '/v1/items', timeout=BACKEND_TIMEOUT)
+        response.raise_for_status()
+        body = response.json()
+        return cls(body['items'], body.get('version'), body.get('model'), body.get('film_index', True))
+
+    def encode(self, films):
+        """Index of each film, -1 where the model doesn't know it."""
+        return self.ids.get_indexer(pd.Index(films)).astype(np.int32)
+
+    def decode(self, indices):
+        return self.ids.to_numpy()[np.asarray(indices)]
+
+    def bitset(self, indices):
+        """Boolean mask over the vocabulary with the known indices set."""
+        indices = np.asarray(indices)
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[indices[indices >= 0]] = True
+        return mask
+
+
+def pack_ratings(indices, ratings, exclude=(), k=10, options=None):
+    indices = np.asarray(indices, dtype='<i4')
+    ratings = np.asarray(ratings, dtype='<f4')
+    exclude = np.asarray(exclude, dtype='<i4')
+    tail = json.dumps(options).encode() if options else b''
+    header = PACKED_HEADER.pack(PACKED_MAGIC, len(indices), len(exclude), k)
+    return header + indices.tobytes() + ratings.tobytes() + exclude.tobytes() + tail
+
+
+def post_packed(api_base, vocabulary, indices, ratings, exclude, k, options):
+    options = dict(options, vocabulary=vocabulary.version)
+    response = requests.post(api_base + '/v1/recommendations/packed',
+                             data=pack_ratings(indices, ratings, exclude, k, options),
+                             headers={'Content-Type': 'application/octet-stream'}, timeout=BACKEND_TIMEOUT)
+    if response.status_code == 409:
+        raise VocabularyChanged(response.json().get('detail'))
+    response.raise_for_status()
+    return response.json()